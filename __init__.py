@@ -1,2 +1,3 @@
 from .filterbank_stats import FilterbankStats, analyse_filterbank
 from .block_stats import analyse_block
+from .catalog import StatsCatalog
@@ -0,0 +1,41 @@
+### Standard library imports
+import argparse
+import os
+
+### Local module imports
+from rfistats.batch import find_inputs, analyse_many, write_summary
+
+###############################################################################
+
+def parse_args():
+    """ Parse command line arguments with which the script was called. Returns
+    an object containing them all.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('paths', type=str, nargs='+', help='Input filterbank files, directories (all .fil files inside are processed) or glob patterns.')
+    parser.add_argument('-o', '--outdir', type=str, required=True, help='Output directory. The output of input name.fil is name.h5, or subdir__name.h5 if inputs are in several directories.')
+    parser.add_argument('--nworkers', type=int, help='Number of files processed in parallel.', default=1)
+    parser.add_argument('--gulp', type=int, help='Number of samples read into a single data block.', default=2000)
+    parser.add_argument('--wmax', type=int, help='Maximum pulse width (in samples) being searched for.', default=128)
+    parser.add_argument('--wtsp', type=float, help='Ratio between two consecutive pulse width trials.', default=2.0)
+    parser.add_argument('--thr', type=float, help='S/N threshold used to flag significant pulses when computing channel occupancy.', default=6.0)
+    parser.add_argument('--precision', type=str, choices=('float32', 'float64'), help='Floating point precision of the convolution products.', default='float32')
+    parser.add_argument('--nthreads', type=int, help='Number of threads analysing chunks of channels in parallel, within every data block.', default=1)
+    parser.add_argument('--force', action='store_true', help='Process all inputs, even those whose output already exists with the same parameters.')
+    parser.add_argument('--summary', type=str, help='CSV file where the per-file status and throughput are written. Default: batch_summary.csv in the output directory.', default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    fnames = find_inputs(args.paths)
+    summaries = analyse_many(
+        fnames, args.outdir, nworkers=args.nworkers, gulp=args.gulp, wmax=args.wmax, wtsp=args.wtsp, thr=args.thr,
+        precision=args.precision, nthreads=args.nthreads, force=args.force)
+    summary_file = args.summary or os.path.join(args.outdir, 'batch_summary.csv')
+    write_summary(summaries, summary_file)
+    print('Summary written to {0:s}'.format(summary_file))
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -1,15 +1,34 @@
 ### Standard library imports
 import argparse
+import json
+import sys
 from collections import namedtuple
 
 ### Non-standard imports
 import numpy as np
 
 ### Local module imports
+from rfistats.filterbank import Filterbank
 from rfistats.filterbank_stats import analyse_filterbank
+from rfistats.autotune import autotune
+from rfistats.shards import plan_shards
+from rfistats.profiling import profile_to_json
 
 ###############################################################################
 
+def gulp_type(value):
+    """ Type of the --gulp argument: a positive integer, or 'auto'. """
+    if value == 'auto':
+        return value
+    try:
+        gulp = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    if gulp <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    return gulp
+
+
 def parse_args():
     """ Parse command line arguments with which the script was called. Returns
     an object containing them all.
@@ -17,20 +36,61 @@ def parse_args():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('fname', type=str, help='SIGPROC 32-bit filterbank file.')
     parser.add_argument('-o', '--outname', type=str, required=True, help='Base name of output file. A suffix .h5 is automatically appended.')
-    parser.add_argument('--gulp', type=int, help='Number of samples read into a single data block.', default=2000)
+    parser.add_argument('--gulp', type=gulp_type, help="Number of samples read into a single data block. 'auto' benchmarks a few candidate gulps, convolution engines and FFT pad lengths on synthetic data, and uses the fastest. The choice is cached per machine. Not available with --nshards.", default=2000)
+    parser.add_argument('--memory-budget', type=float, help="Maximum estimated memory usage in MiB of the configurations tried with --gulp auto.", default=1024.0)
+    parser.add_argument('--retune', action='store_true', help="With --gulp auto, ignore any cached choice and benchmark again.")
     parser.add_argument('--start', type=int, help='Start sample index.', default=0)
     parser.add_argument('--end', type=int, help='End sample index. If not specified (None), process the file until the end.', default=None)
     parser.add_argument('--wmax', type=int, help='Maximum pulse width (in samples) being searched for.', default=128)
     parser.add_argument('--wtsp', type=float, help='Ratio between two consecutive pulse width trials.', default=2.0)
     parser.add_argument('--thr', type=float, help='S/N threshold used to flag significant pulses when computing channel occupancy.', default=6.0)
+    parser.add_argument('--prefetch', type=int, help='Number of data blocks read ahead by a background thread, while the current block is being analysed. 0 disables prefetching.', default=0)
+    parser.add_argument('--nproc', type=int, help='Number of worker processes analysing data blocks in parallel.', default=1)
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted analysis from the last block saved in the output file. Analysis parameters must be identical.')
+    parser.add_argument('--nthreads', type=int, help='Number of threads analysing chunks of channels in parallel, within every data block.', default=1)
+    parser.add_argument('--precision', type=str, choices=('float32', 'float64'), help='Floating point precision of the convolution products.', default='float32')
+    parser.add_argument('--fft-workers', type=int, help='Number of threads used by each FFT, when the FFT convolution engine is used.', default=1)
+    parser.add_argument('--nshards', type=int, help='Split the sample range [start, end) into this number of gulp-aligned shards, and only process one of them. Shard outputs can be merged with merge_stats.py.', default=1)
+    parser.add_argument('--shard', type=int, help='Index of the shard to process, between 0 and nshards - 1.', default=0)
+    parser.add_argument('--profile', action='store_true', help='Record the time spent in every stage of the analysis, bytes read and peak memory usage. Totals are saved as attributes of the profile group of the output file.')
+    parser.add_argument('--profile-json', type=str, help='Also write the profiling summary to this JSON file. Implies --profile.', default=None)
+    parser.add_argument('--quiet', action='store_true', help='Do not report progress.')
     args = parser.parse_args()
+    if not 0 <= args.shard < args.nshards:
+        parser.error('--shard must be between 0 and nshards - 1')
+    # Shard boundaries depend on the gulp, which must then be the same on every node
+    if args.gulp == 'auto' and args.nshards > 1:
+        parser.error('--gulp auto cannot be used with --nshards, an explicit gulp is required')
     return args
 
 
 def main(args):
-    fstats = analyse_filterbank(args.fname, start=args.start, end=args.end, gulp=args.gulp, wmax=args.wmax, wtsp=args.wtsp)
+    # Statistics are written to the output file as they are computed
     outfile = args.outname + '.h5'
-    fstats.save_hdf5(outfile)
+
+    gulp, engine, padlen = args.gulp, 'auto', None
+    if gulp == 'auto':
+        fil = Filterbank(args.fname)
+        end = fil.nsamp if args.end is None else min(args.end, fil.nsamp)
+        tuned = autotune(
+            fil.nchans, wmax=args.wmax, wtsp=args.wtsp, thr=args.thr, nbits=fil.nbits, precision=args.precision,
+            nthreads=args.nthreads, fft_workers=args.fft_workers, memory_budget=args.memory_budget,
+            nsamp_max=end - args.start, retune=args.retune, verbose=not args.quiet)
+        gulp, engine, padlen = tuned['gulp'], tuned['engine'], tuned['padlen']
+        if not args.quiet:
+            print('Autotuned: gulp = {0:d}, engine = {1:s}, padlen = {2!s}'.format(gulp, engine, padlen), file=sys.stderr)
+
+    start, end = plan_shards(args.fname, gulp, args.nshards, start=args.start, end=args.end)[args.shard]
+    profile = args.profile or args.profile_json is not None
+    fstats = analyse_filterbank(
+        args.fname, start=start, end=end, gulp=gulp, wmax=args.wmax, wtsp=args.wtsp, thr=args.thr,
+        prefetch=args.prefetch, nproc=args.nproc, nthreads=args.nthreads,
+        precision=args.precision, fft_workers=args.fft_workers, engine=engine, padlen=padlen, outfile=outfile, resume=args.resume,
+        profile=profile, progress=not args.quiet)
+
+    if args.profile_json:
+        with open(args.profile_json, 'w') as fobj:
+            json.dump(profile_to_json(fstats.profile), fobj, indent=4)
 
 if __name__ == '__main__':
     args = parse_args()
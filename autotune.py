@@ -0,0 +1,182 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import scipy
+import scipy.fft
+
+from rfistats.benchmark import generate_samples
+from rfistats.block_stats import analyse_block
+from rfistats.convolution import generate_width_trials, padlength
+
+# Gulps tried by default, in number of samples
+DEFAULT_GULPS = (1024, 2048, 4096, 8192, 16384)
+
+# Convolution products, and arrays of the same size, held in memory at once when
+# processing a chunk of channels, as a multiple of the size of the convolution products
+_MEMORY_FACTORS = {'cumsum': 2.5, 'fft': 3.5}
+
+
+def default_cache_file():
+    """ Path of the file where autotuning results are cached, in $XDG_CACHE_HOME/rfistats
+    or ~/.cache/rfistats. """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'rfistats', 'autotune.json')
+
+
+def machine_key():
+    """ String identifying the machine and the software versions that determine the
+    outcome of autotuning. A cache file shared between machines (e.g. on a network
+    file system) holds separate entries for each. """
+    return '{0:s}/{1:s}/{2:d}cpu/numpy-{3:s}/scipy-{4:s}'.format(
+        platform.node(), platform.machine(), os.cpu_count() or 1, np.__version__, scipy.__version__)
+
+
+def candidate_padlengths(n):
+    """ Candidate FFT lengths for zero-padding data to at least n samples: the default
+    choice padlength(n), scipy's next fast real FFT length, and the next power of two. """
+    lengths = {padlength(n), scipy.fft.next_fast_len(n, real=True), 2**int(np.ceil(np.log2(n)))}
+    return sorted(lengths)
+
+
+def estimate_memory(nchan, gulp, wmax, wtsp, engine='cumsum', padlen=None, precision='float32', nbits=32, nthreads=1, chunksize=256):
+    """ Rough estimate of the peak memory used by the analysis of a data block, in bytes.
+    It accounts for the input block and, for each thread, the normalised data and
+    convolution products of one chunk of channels along with the temporary arrays of the
+    occupancy mask stage. With the 'fft' engine, padlen defaults to
+    padlength(gulp + wmax + 1) like in BoxcarConvolver. """
+    nwidths = len(generate_width_trials(int(wmax), wtsp))
+    if engine == 'fft':
+        length = padlen if padlen is not None else padlength(gulp + int(wmax) + 1)
+    else:
+        length = gulp
+    nchunk = min(nchan, chunksize) * max(1, min(nthreads, -(-nchan // chunksize)))
+    itemsize = np.dtype(precision).itemsize
+    block = gulp * nchan * nbits // 8
+    chunks = nchunk * (gulp * 4 + _MEMORY_FACTORS[engine] * nwidths * length * itemsize)
+    return int(block + chunks)
+
+
+def time_config(data, gulp, wmax, wtsp, thr, engine, padlen, repeat=3, **kwargs):
+    """ Time the analysis of the first 'gulp' samples of 'data' with a given engine and
+    pad length, after one untimed run. Returns the best time per sample over 'repeat'
+    runs. """
+    block = data[:gulp]
+    kwargs = dict(kwargs, wmax=wmax, wtsp=wtsp, thr=thr, engine=engine, padlen=padlen, stats_only=True)
+    analyse_block(block, **kwargs)
+    best = float('inf')
+    for __ in range(max(1, int(repeat))):
+        t = time.perf_counter()
+        analyse_block(block, **kwargs)
+        best = min(best, time.perf_counter() - t)
+    return best / gulp
+
+
+def autotune(nchan, wmax=128, wtsp=2.0, thr=6.0, nbits=32, precision='float32', nthreads=1, fft_workers=1, memory_budget=1024.0, gulps=DEFAULT_GULPS, nsamp_max=None, repeat=3, cache_file=None, retune=False, verbose=False):
+    """ Find the fastest gulp, convolution engine and FFT pad length for analysing data
+    with the given number of channels and analysis parameters on this machine.
+
+    Every gulp in 'gulps' is tried with the 'cumsum' engine, and with the 'fft' engine for
+    every length in candidate_padlengths(). Configurations whose estimated memory usage
+    (see estimate_memory()) exceeds the budget are skipped. Each configuration is timed
+    on synthetic data, using as many channels as are processed at once (one chunk per
+    thread) since the cost per sample is proportional to the number of channels. The
+    result is cached per machine, see default_cache_file() and machine_key().
+
+    Note that the gulp is also the time resolution of the output statistics.
+
+    Parameters:
+    -----------
+        nchan: int
+            Number of channels of the data.
+        wmax, wtsp, thr:
+            Analysis parameters, see analyse_filterbank().
+        nbits: int
+            Bit depth of the data, 8 or 32.
+        precision, nthreads, fft_workers:
+            Analysis options, see analyse_filterbank().
+        memory_budget: float
+            Maximum estimated memory usage in MiB.
+        gulps: list
+            Candidate gulps in number of samples. Those not larger than wmax are
+            ignored.
+        nsamp_max: int or None
+            If specified, gulps larger than this (e.g. the length of the file to process)
+            are not tried.
+        repeat: int
+            Number of timed runs per configuration.
+        cache_file: str or None
+            Path of the cache file, default is default_cache_file().
+        retune: bool
+            If True, ignore any cached result.
+        verbose: bool
+            If True, print the time per sample of every configuration.
+
+    Returns:
+    --------
+        result: dict
+            The fastest 'gulp', 'engine' and 'padlen' (None for the 'cumsum' engine),
+            along with its processing time per sample in seconds for all channels
+            ('seconds_per_sample'), estimated memory usage in MiB ('memory_mb'), and the
+            'trials' of all candidate configurations.
+    """
+    if not nbits in (8, 32):
+        raise ValueError('nbits must be 8 or 32')
+    if nsamp_max is not None and nsamp_max <= 0:
+        raise ValueError('nsamp_max must be positive, there are no samples to analyse')
+    gulps = sorted(int(gulp) for gulp in gulps if wmax < gulp and (nsamp_max is None or gulp <= nsamp_max))
+    if not gulps:
+        raise ValueError('No candidate gulp is both larger than wmax and no larger than nsamp_max')
+
+    cache_file = cache_file or default_cache_file()
+    key = 'nchan={0:d},nbits={1:d},wmax={2:d},wtsp={3:g},thr={4:g},precision={5:s},nthreads={6:d},fft_workers={7:d},memory_budget={8:g},gulps={9:s}'.format(
+        int(nchan), nbits, int(wmax), wtsp, thr, precision, int(nthreads), int(fft_workers), memory_budget,
+        '/'.join(map(str, gulps)))
+    cache = {}
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as fobj:
+                cache = json.load(fobj)
+        except (OSError, ValueError):
+            cache = {}
+    if not retune and key in cache.get(machine_key(), {}):
+        return cache[machine_key()][key]
+
+    chunksize = 256
+    nchan_bench = min(int(nchan), chunksize * max(1, int(nthreads)))
+    # Noise, pulses and RFI channels, so that the occupancy mask stage has work to do
+    data = next(generate_samples(max(gulps), nchan=nchan_bench, nbits=nbits, chunksize=max(gulps)))
+    kwargs = dict(chunksize=chunksize, precision=precision, nthreads=nthreads, fft_workers=fft_workers)
+
+    trials = []
+    for gulp in gulps:
+        configs = [('cumsum', None)] + [('fft', n) for n in candidate_padlengths(gulp + wmax + 1)]
+        for engine, padlen in configs:
+            memory = estimate_memory(
+                nchan, gulp, wmax, wtsp, engine=engine, padlen=padlen, precision=precision, nbits=nbits,
+                nthreads=nthreads, chunksize=chunksize) / 2**20
+            if memory > memory_budget:
+                continue
+            seconds = time_config(data, gulp, wmax, wtsp, thr, engine, padlen, repeat=repeat, **kwargs)
+            seconds *= nchan / nchan_bench
+            trials.append({'gulp': gulp, 'engine': engine, 'padlen': padlen, 'seconds_per_sample': seconds, 'memory_mb': memory})
+            if verbose:
+                print('gulp = {0:6d}  engine = {1:6s}  padlen = {2!s:>6s}  {3:.3e} s/sample  {4:8.1f} MiB'.format(
+                    gulp, engine, padlen, seconds, memory))
+    if not trials:
+        raise ValueError('No configuration fits within the memory budget of {0:g} MiB'.format(memory_budget))
+
+    result = dict(min(trials, key=lambda trial: trial['seconds_per_sample']))
+    result['trials'] = trials
+    result['date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    cache.setdefault(machine_key(), {})[key] = result
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    # Write then rename, so that concurrent runs never see a partially written file
+    tmpname = '{0:s}.{1:d}.tmp'.format(cache_file, os.getpid())
+    with open(tmpname, 'w') as fobj:
+        json.dump(cache, fobj, indent=4)
+    os.replace(tmpname, cache_file)
+    return result
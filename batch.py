@@ -0,0 +1,171 @@
+import csv
+import glob
+import multiprocessing
+import os
+import time
+
+import h5py
+
+from rfistats.filterbank import Filterbank
+from rfistats.filterbank_stats import analyse_filterbank
+
+# Analysis parameters that, along with the input file size and modification time,
+# identify an output. An input whose output has the same key is not processed again.
+KEY_PARAMS = ('gulp', 'wmax', 'wtsp', 'thr', 'precision', 'engine')
+
+SUMMARY_FIELDS = (
+    'fname', 'outfile', 'status', 'nsamp', 'nchans', 'bytes', 'wall_time',
+    'samples_per_sec', 'mb_per_sec', 'realtime_factor', 'error')
+
+
+def find_inputs(paths, pattern='*.fil'):
+    """ Expand a list of paths, each being a file, a directory (all files inside matching
+    'pattern' are used) or a glob pattern, into a sorted list of unique file paths. """
+    fnames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            fnames.update(glob.glob(os.path.join(path, pattern)))
+        elif os.path.isfile(path):
+            fnames.add(path)
+        else:
+            fnames.update(glob.glob(path))
+    return sorted(os.path.abspath(fname) for fname in fnames)
+
+
+def output_names(fnames):
+    """ Output file names of the given inputs: their paths relative to the deepest
+    directory containing them all, with the extension replaced by '.h5' and directory
+    separators by '__'. Inputs in a single directory keep their base name, while e.g.
+    'beam00/obs.fil' and 'beam01/obs.fil' become 'beam00__obs.h5' and 'beam01__obs.h5'.
+    A ValueError is raised if two inputs would still get the same name. """
+    fnames = [os.path.abspath(fname) for fname in fnames]
+    if not fnames:
+        return []
+    common = os.path.commonpath([os.path.dirname(fname) for fname in fnames])
+    names = [
+        os.path.splitext(os.path.relpath(fname, common))[0].replace(os.sep, '__') + '.h5'
+        for fname in fnames
+        ]
+    seen = {}
+    for fname, name in zip(fnames, names):
+        if name in seen:
+            raise ValueError('Inputs {0!r} and {1!r} have the same output name {2!r}'.format(seen[name], fname, name))
+        seen[name] = fname
+    return names
+
+
+def output_status(fname, outfile, **params):
+    """ Compare an existing output with what an analysis of 'fname' with the given
+    parameters would produce. Returns 'done' if the output is complete and has the same
+    key (see KEY_PARAMS), 'partial' if it has the same key but is incomplete, and
+    'stale' if it is missing, unreadable or has a different key. 'params' must contain
+    all KEY_PARAMS, any other parameter is ignored. """
+    if not os.path.isfile(outfile):
+        return 'stale'
+    key = {name: params[name] for name in KEY_PARAMS}
+    key.update(input_size=os.path.getsize(fname), input_mtime=os.path.getmtime(fname))
+    try:
+        with h5py.File(outfile, 'r') as fobj:
+            stored = dict(fobj['params'].attrs)
+            complete = bool(fobj['progress'].attrs['complete'])
+    except (OSError, KeyError):
+        return 'stale'
+    if any(stored.get(name) != val for name, val in key.items()):
+        return 'stale'
+    return 'done' if complete else 'partial'
+
+
+def _analyse_one(args):
+    """ Analyse one file in a worker process, and return its summary. Errors are
+    reported in the summary rather than raised, so that one bad file does not stop
+    the batch. """
+    fname, outfile, params, kwargs, force = args
+    summary = dict.fromkeys(SUMMARY_FIELDS, '')
+    summary.update({'fname': fname, 'outfile': outfile})
+    try:
+        fil = Filterbank(fname)
+        summary.update({'nsamp': fil.nsamp, 'nchans': fil.nchans})
+        status = 'stale' if force else output_status(fname, outfile, **params)
+        if status == 'done':
+            summary['status'] = 'skipped'
+            return summary
+
+        # Blocks already done by a previous run, that are not processed again
+        nblock_done = 0
+        if status == 'partial':
+            with h5py.File(outfile, 'r') as fobj:
+                nblock_done = int(fobj['progress'].attrs['nblock'])
+
+        start = time.perf_counter()
+        fstats = analyse_filterbank(fname, outfile=outfile, resume=(status == 'partial'), **params, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        nsamp = (fstats.nblock - nblock_done) * fstats.gulp
+        nbytes = nsamp * fil.bytes_per_sample
+        summary.update({
+            'status': 'resumed' if status == 'partial' else 'done',
+            'bytes': nbytes,
+            'wall_time': elapsed,
+            'samples_per_sec': nsamp / elapsed,
+            'mb_per_sec': nbytes / elapsed / 2**20,
+            'realtime_factor': nsamp * fil.tsamp / elapsed,
+            })
+    except Exception as err:
+        summary.update({'status': 'failed', 'error': '{0:s}: {1!s}'.format(type(err).__name__, err)})
+    return summary
+
+
+def analyse_many(fnames, outdir, nworkers=1, gulp=2048, wmax=128, wtsp=2.0, thr=6.0, precision='float32', engine='auto', force=False, **kwargs):
+    """ Analyse many filterbank files with a pool of worker processes, each worker
+    processing one file at a time. The output of input 'name.fil' is 'outdir/name.h5',
+    or 'outdir/subdir__name.h5' if inputs are in different directories, see
+    output_names().
+    Inputs whose output already exists with the same key (input file size and
+    modification time, and the analysis parameters listed in KEY_PARAMS) are skipped,
+    and those whose output is incomplete are resumed.
+
+    Parameters:
+    -----------
+        fnames: list
+            Input filterbank file paths.
+        outdir: str
+            Output directory, created if necessary.
+        nworkers: int
+            Number of worker processes.
+        gulp, wmax, wtsp, thr, precision, engine:
+            Analysis parameters, see analyse_filterbank().
+        force: bool
+            If True, process all inputs again.
+        **kwargs:
+            Other keyword arguments passed to analyse_filterbank(), e.g. nthreads.
+
+    Returns:
+    --------
+        summaries: list
+            One dict per input with keys SUMMARY_FIELDS, in the order of 'fnames'.
+    """
+    names = output_names(fnames)
+    os.makedirs(outdir, exist_ok=True)
+    params = dict(gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr, precision=precision, engine=engine)
+    tasks = [
+        (fname, os.path.join(outdir, name), params, kwargs, force)
+        for fname, name in zip(fnames, names)
+        ]
+
+    # Largest files first, so that workers do not end up waiting for one last big file
+    order = sorted(range(len(tasks)), key=lambda index: -os.path.getsize(tasks[index][0]))
+    summaries = [None] * len(tasks)
+    with multiprocessing.Pool(max(1, int(nworkers))) as pool:
+        results = pool.imap(_analyse_one, [tasks[index] for index in order])
+        for index, summary in zip(order, results):
+            summaries[index] = summary
+            print('{fname:s}: {status:s}'.format(**summary))
+    return summaries
+
+
+def write_summary(summaries, fname):
+    """ Write the summaries returned by analyse_many() to a CSV file. """
+    with open(fname, 'w', newline='') as fobj:
+        writer = csv.DictWriter(fobj, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
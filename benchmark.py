@@ -0,0 +1,317 @@
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import scipy
+import h5py
+
+from rfistats.sigproc_header import write_sigproc_header
+from rfistats.block_stats import analyse_block
+from rfistats.convolution import clear_convolver_cache, convolver_cache_info
+from rfistats.filterbank_stats import FilterbankIterator, analyse_filterbank
+
+# Stages of the analysis timed separately, in processing order
+STAGES = ('read', 'normalise', 'convolve', 'mask', 'aggregate', 'save_hdf5')
+
+# Default injected pulses: (position as a fraction of the file length, width in
+# samples, S/N in every channel)
+DEFAULT_PULSES = [
+    (0.1, 1, 12.0),
+    (0.3, 4, 12.0),
+    (0.5, 16, 12.0),
+    (0.7, 64, 12.0),
+    (0.9, 256, 12.0),
+    ]
+
+
+def generate_samples(nsamp, nchan=4096, nbits=8, pulses=DEFAULT_PULSES, rfi_fraction=0.05, seed=0, chunksize=4096):
+    """ Generate synthetic data made of Gaussian noise, broadband pulses and RFI
+    channels, in chunks of samples. Yields arrays of shape (num_samples, nchan), int8
+    if nbits is 8 and float32 if it is 32. See generate_filterbank() for a description
+    of the parameters. """
+    if not nbits in (8, 32):
+        raise ValueError('nbits must be 8 or 32')
+    rng = np.random.default_rng(seed)
+    sigma = 16.0
+    rfi_chans = rng.choice(nchan, size=int(round(rfi_fraction * nchan)), replace=False)
+
+    for istart in range(0, nsamp, chunksize):
+        iend = min(istart + chunksize, nsamp)
+        data = rng.standard_normal((iend - istart, nchan), dtype=np.float32)
+        data *= sigma
+
+        for position, width, snr in pulses:
+            pstart = int(position * nsamp) - width // 2
+            lo, hi = max(pstart, istart), min(pstart + width, iend)
+            if lo < hi:
+                data[lo-istart:hi-istart] += snr * sigma * width**-0.5
+
+        # RFI: on/off bursts, each sample starting a burst with 1% probability
+        if len(rfi_chans):
+            bursts = rng.random((iend - istart, len(rfi_chans))) < 0.01
+            bursts = np.maximum.accumulate(bursts * np.arange(1, iend - istart + 1)[:, None], axis=0)
+            lengths = rng.integers(1, 64, size=len(rfi_chans))
+            on = (bursts > 0) & (np.arange(1, iend - istart + 1)[:, None] - bursts < lengths)
+            data[:, rfi_chans] += on * (8 * sigma)
+
+        if nbits == 8:
+            data = np.clip(np.round(data), -128, 127).astype(np.int8)
+        yield data
+
+
+def generate_filterbank(fname, nsamp, nchan=4096, tsamp=153.0e-6, nbits=8, fch1=1712.0, bandwidth=-856.0, pulses=DEFAULT_PULSES, rfi_fraction=0.05, seed=0, chunksize=4096):
+    """ Write a synthetic SIGPROC filterbank file made of Gaussian noise, broadband pulses
+    and RFI channels. Data are generated in chunks of samples, so that files much
+    larger than memory can be made.
+
+    Parameters:
+    -----------
+        fname: str
+            Output file name.
+        nsamp: int
+            Number of samples.
+        nchan: int
+            Number of channels.
+        tsamp: float
+            Sampling time in seconds.
+        nbits: int
+            Either 8 (signed 8-bit integers) or 32 (float32).
+        fch1: float
+            Frequency of the first channel in MHz.
+        bandwidth: float
+            Total bandwidth in MHz, negative if channel frequencies decrease.
+        pulses: list
+            List of (position, width, snr) tuples, where position is a fraction of the
+            file length, width is in samples, and snr is the S/N of the pulse in every
+            channel.
+        rfi_fraction: float
+            Fraction of channels affected by RFI, i.e. bright bursts of random
+            lengths and intervals.
+        seed: int
+            Random seed.
+        chunksize: int
+            Number of samples generated at once.
+    """
+    if not nbits in (8, 32):
+        raise ValueError('nbits must be 8 or 32')
+    header = {
+        'source_name': 'SYNTHETIC',
+        'data_type': 1,
+        'nbits': nbits,
+        'nchans': nchan,
+        'nifs': 1,
+        'tsamp': tsamp,
+        'tstart': 60000.0,
+        'fch1': fch1,
+        'foff': bandwidth / nchan,
+        'src_raj': 0.0,
+        'src_dej': 0.0,
+        }
+    if nbits == 8:
+        header['signed'] = True
+
+    chunks = generate_samples(
+        nsamp, nchan=nchan, nbits=nbits, pulses=pulses, rfi_fraction=rfi_fraction, seed=seed, chunksize=chunksize)
+    with open(fname, 'wb') as fobj:
+        write_sigproc_header(fobj, header)
+        for data in chunks:
+            fobj.write(data.tobytes())
+
+
+def drop_page_cache(fname):
+    """ Ask the kernel to evict a file from the page cache, so that the next analysis
+    reads it from disk rather than from memory, like it would for a file that was just
+    recorded. Returns False if this is not supported on this system (it requires
+    os.posix_fadvise, i.e. Linux or another Unix). """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    with open(fname, 'rb') as fobj:
+        # Dirty pages are not evicted, write them to disk first
+        os.fsync(fobj.fileno())
+        os.posix_fadvise(fobj.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+
+def time_stages(fname, gulp=2048, wmax=128, wtsp=2.0, thr=6.0, outfile=None, **kwargs):
+    """ Run analyse_filterbank() with profiling enabled, so that every stage listed in
+    STAGES is timed inside the production code path (see profiling.Profiler), then save
+    the result to 'outfile' if specified. The 'read' stage includes reading the pages of
+    every block into memory: it measures actual I/O if the file is not in the page cache
+    (see drop_page_cache()), and memory copy speed otherwise. Extra keyword arguments, e.g. engine,
+    precision or padlen, are passed to analyse_filterbank(). Returns a dict
+    {stage: seconds}, along with the number of samples processed. """
+    fstats = analyse_filterbank(fname, gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr, profile=True, **kwargs)
+    timings = {stage: fstats.profile[stage + '_wall'] for stage in STAGES if stage != 'save_hdf5'}
+    timings['save_hdf5'] = 0.0
+    if outfile is not None:
+        t = time.perf_counter()
+        fstats.save_hdf5(outfile)
+        timings['save_hdf5'] = time.perf_counter() - t
+    return timings, fstats.nblock * fstats.gulp
+
+
+def compare_precisions(fname, gulp=2048, wmax=128, wtsp=2.0, thr=6.0, engine='auto'):
+    """ Compare the occupancy masks obtained with float32 and float64 convolution
+    products on every block of a filterbank file.
+
+    Returns:
+    --------
+        result: dict
+            Total number of samples, number and fraction of samples flagged differently,
+            max and mean absolute difference of the occupancy of a channel in a block.
+    """
+    kwargs = dict(wmax=wmax, wtsp=wtsp, thr=thr, engine=engine)
+    nsamp = 0
+    mismatch = 0
+    max_diff = 0.0
+    sum_diff = 0.0
+    nvalues = 0
+    for block in FilterbankIterator(fname, gulp=gulp, native_dtype=True):
+        __, mask32, stats32 = analyse_block(block.data, precision='float32', **kwargs)
+        __, mask64, stats64 = analyse_block(block.data, precision='float64', **kwargs)
+        nsamp += mask32.size
+        mismatch += np.count_nonzero(mask32 != mask64)
+        diff = np.abs(stats32['occupancy'] - stats64['occupancy'])
+        max_diff = max(max_diff, diff.max())
+        sum_diff += diff.sum()
+        nvalues += diff.size
+    return {
+        'samples': int(nsamp),
+        'mask_mismatch': int(mismatch),
+        'mask_mismatch_fraction': mismatch / nsamp if nsamp else 0.0,
+        'max_occupancy_diff': float(max_diff),
+        'mean_occupancy_diff': sum_diff / nvalues if nvalues else 0.0,
+        }
+
+
+def git_revision():
+    """ Commit hash of the code being benchmarked, or None if unavailable. """
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine_info():
+    """ Information about the machine and software versions, stored with the results
+    to make comparisons meaningful. """
+    return {
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'h5py': h5py.__version__,
+        'git_revision': git_revision(),
+        }
+
+
+def run_benchmark(workdir, nchan=4096, tsamp=153.0e-6, duration=10.0, nbits=(8, 32), gulp=2048, wmax=128, wtsp=2.0, thr=6.0, engine='auto', precision='float32', padlen=None, check_precision=False, keep_files=False):
+    """ Benchmark the analysis on synthetic filterbanks, one per number of bits.
+
+    Every stage (see STAGES) is timed separately, then the complete analyse_filterbank()
+    function is timed on its own ('end_to_end'). For each, the throughput in samples per
+    second and the real-time factor (observation length divided by processing time)
+    are reported. The synthetic file is evicted from the page cache before each of the
+    two runs where supported (see drop_page_cache()), so that they include reading it
+    from disk; whether it was is reported under 'cold_cache'.
+
+    Parameters:
+    -----------
+        workdir: str
+            Directory where the temporary input and output files are written.
+        nchan, tsamp: int, float
+            Number of channels and sampling time of the synthetic data.
+        duration: float
+            Length of the synthetic data in seconds.
+        nbits: list
+            Bit depths to benchmark, 8 and/or 32.
+        gulp, wmax, wtsp, thr:
+            Analysis parameters, see analyse_filterbank().
+        engine, precision, padlen:
+            Convolution options, see analyse_filterbank().
+        check_precision: bool
+            If True, also compare the occupancy masks obtained with float32 and
+            float64 precision, see compare_precisions().
+        keep_files: bool
+            If False, delete the synthetic data and outputs when done.
+
+    Returns:
+    --------
+        results: dict
+            Machine information, parameters, and results for every bit depth. The
+            hits and misses of the BoxcarConvolver cache during the end-to-end run are
+            under 'convolver_cache'.
+    """
+    nsamp = int(duration / tsamp)
+    if nsamp < gulp:
+        raise ValueError(
+            'duration / tsamp = {0:d} samples is less than one gulp of {1:d} samples, there would be nothing to analyse'.format(nsamp, gulp))
+    os.makedirs(workdir, exist_ok=True)
+    params = dict(
+        nchan=nchan, tsamp=tsamp, nsamp=nsamp, gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr,
+        engine=engine, precision=precision, padlen=padlen)
+    options = dict(engine=engine, precision=precision, padlen=padlen)
+    results = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': machine_info(),
+        'params': params,
+        'results': {},
+        }
+
+    for bits in nbits:
+        fname = os.path.join(workdir, 'synthetic_{0:d}bit.fil'.format(bits))
+        outfile = os.path.join(workdir, 'synthetic_{0:d}bit.h5'.format(bits))
+        generate_filterbank(fname, nsamp, nchan=nchan, tsamp=tsamp, nbits=bits)
+        try:
+            cold_cache = drop_page_cache(fname)
+            timings, nsamp_processed = time_stages(fname, gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr, outfile=outfile, **options)
+
+            drop_page_cache(fname)
+            clear_convolver_cache()
+            t = time.perf_counter()
+            analyse_filterbank(fname, gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr, **options)
+            timings['end_to_end'] = time.perf_counter() - t
+            cache_info = convolver_cache_info()
+            if check_precision:
+                precision_check = compare_precisions(fname, gulp=gulp, wmax=wmax, wtsp=wtsp, thr=thr, engine=engine)
+        finally:
+            if not keep_files:
+                for path in (fname, outfile):
+                    if os.path.isfile(path):
+                        os.remove(path)
+
+        tobs = nsamp_processed * tsamp
+        config = '{0:d}bit'.format(bits)
+        results['results'][config] = {
+            stage: {
+                'seconds': seconds,
+                'samples_per_sec': nsamp_processed / seconds if seconds else None,
+                'realtime_factor': tobs / seconds if seconds else None,
+                }
+            for stage, seconds in timings.items()
+            }
+        results.setdefault('cold_cache', {})[config] = cold_cache
+        results.setdefault('convolver_cache', {})[config] = {'hits': cache_info.hits, 'misses': cache_info.misses}
+        if check_precision:
+            results.setdefault('precision_check', {})[config] = precision_check
+    return results
+
+
+def compare_results(old, new):
+    """ Compare two outputs of run_benchmark(). Returns a dict {(config, stage): speedup},
+    where speedup is the ratio of old to new processing times. """
+    speedups = {}
+    for config, stages in new['results'].items():
+        for stage, result in stages.items():
+            previous = old['results'].get(config, {}).get(stage)
+            if previous and previous['seconds'] and result['seconds']:
+                speedups[(config, stage)] = previous['seconds'] / result['seconds']
+    return speedups
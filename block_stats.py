@@ -1,20 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import pandas
+from scipy.ndimage import maximum_filter1d
+
+from rfistats.stats_utils import median_and_robust_std
+from rfistats.convolution import get_convolver
+from rfistats.profiling import NULL_PROFILER
+
+# Names of the per-channel statistics computed by analyse_block()
+STATS_KEYS = ('median', 'robust_std', 'avg_power', 'occupancy')
+
+
+def _normalised_dtype(data):
+    """ Floating point type of the normalised version of 'data'. """
+    return data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float32)
 
-from rfistats.stats_utils import robust_std
-from rfistats.convolution import BoxcarConvolver
 
 def normalise_block(data):
-    med = np.median(data, axis=0)
-    std = robust_std(data, axis=0)
+    """ Normalise every channel of a data block with shape (num_samples, num_channels)
+    to zero median and unit robust standard deviation. 8-bit integer data are
+    normalised without being cast first, and results are then identical to those
+    obtained on data.astype(np.float32). """
+    med, std = median_and_robust_std(data, axis=0, dtype=_normalised_dtype(data))
     ndata = (data - med) / std
     return ndata, med, std
 
 
+def _occupancy_mask(x, widths, thr=6.0):
+    """ Array-based occupancy mask engine. Returns a mask bit-identical to the one
+    produced by occupancy_mask_1d_reference().
+
+    Parameters:
+    -----------
+        x: ndarray
+            Convolution products, of shape (..., num_widths, num_samples). Any
+            leading axes (e.g. channels) are processed independently.
+        widths: ndarray
+            Boxcar widths corresponding to the second to last axis of x.
+        thr: float
+            threshold in number of sigma
+
+    Returns:
+    --------
+        mask: ndarray
+            Boolean mask of shape (..., num_samples).
+    """
+    # Trivial first step: flag any data point above threshold
+    mask = x[..., 0, :] > thr
+
+    # xmax[..., iw, :] is the max S/N over all widths up to widths[iw]
+    xmax = np.maximum.accumulate(x, axis=-2)
+
+    # The reference implementation rejects any pulse that overlaps with a NaN,
+    # because the comparison with a NaN maximum is always False.
+    nan = np.isnan(xmax)
+    has_nan = nan.any()
+    if has_nan:
+        xmax[nan] = np.inf
+
+    for iw, width in enumerate(widths[1:], start=1):
+        y = x[..., iw, :]
+        m = y > thr
+        if not m.any():
+            continue
+
+        # Window of a pulse of width 'width' centered around sample ii is [ii-hw, ii+hw],
+        # clipped to the data boundaries. Edge replication ('nearest') is equivalent
+        # to clipping when computing a running max.
+        hw = width // 2
+        size = 2 * hw + 1
+        peak = maximum_filter1d(xmax[..., iw, :], size, axis=-1, mode='nearest')
+
+        # To be considered a significant pulse, it must attain or exceed the S/N of any
+        # overlapping pulse with a width up to 'width'
+        m &= y >= peak # this is a GREATER OR EQUAL SIGN BY THE WAY. IMPORTANT.
+        if has_nan:
+            m &= maximum_filter1d(nan[..., iw, :].view(np.uint8), size, axis=-1, mode='nearest') == 0
+
+        # Flag every sample of the accepted pulses
+        mask |= maximum_filter1d(m.view(np.uint8), size, axis=-1, mode='constant', cval=0).view(bool)
+    return mask
+
+
 def occupancy_mask_1d(ndata, convolver, thr=6.0):
     """ Find out which samples in a normalised time series are part of a statistically
     significant pulse.
 
+    Parameters:
+    -----------
+        ndata: ndarray, 1D
+            Normalised data segment from a single channel.
+        convolver: BoxcarConvolver
+            BoxcarConvolver instance adapted to data's number of samples.
+        thr: float
+            threshold in number of sigma
+            
+    Returns:
+    --------
+        conv: ndarray
+            Convolution products of ndata with all boxcars.
+        mask: ndarray
+            Mask equal to True for all samples considered part of a pulse with a S/N exceeding
+            the specified threshold 'thr'.
+    """
+    # Convolution products
+    x = convolver.process(ndata)
+    mask = _occupancy_mask(x, convolver.widths, thr=thr)
+    return x, mask
+
+
+def occupancy_mask_1d_reference(ndata, convolver, thr=6.0):
+    """ Reference (pure python loop) implementation of occupancy_mask_1d(). Slow, but
+    straightforward to read: it is kept to validate the array-based engine.
+
+    Find out which samples in a normalised time series are part of a statistically
+    significant pulse.
+
     Parameters:
     -----------
         ndata: ndarray, 1D
@@ -58,7 +159,7 @@ def occupancy_mask_1d(ndata, convolver, thr=6.0):
     return x, mask
 
     
-def analyse_segment(data, convolver, thr=6.0):
+def analyse_segment(data, convolver, thr=6.0, stats_only=False):
     """ Compute a number of statistics of a 1D time series.
 
     Parameters:
@@ -69,6 +170,9 @@ def analyse_segment(data, convolver, thr=6.0):
             BoxcarConvolver instance adapted to data's number of samples.
         thr: float
             Significance threshold in number of Gaussian sigmas.
+        stats_only: bool
+            If True, only return the scalar statistics, and not the normalised data,
+            convolution products and occupancy mask.
             
     Returns:
     --------
@@ -91,15 +195,41 @@ def analyse_segment(data, convolver, thr=6.0):
         'robust_std' : std,
         'occupancy' : occupancy,
         'avg_power' : avg_power,
-        'ndata' : ndata,
-        'conv' : conv,
-        'mask' : mask,
         }
+    if not stats_only:
+        stats.update({
+            'ndata' : ndata,
+            'conv' : conv,
+            'mask' : mask,
+            })
     
     return stats
 
 
-def analyse_block(data, wmax=256, wtsp=2.0, thr=6.0):
+def _analyse_channels(data, chans, convolver, thr, out, profiler=NULL_PROFILER):
+    """ Analyse the channel range 'chans' of a data block, writing all results into
+    the pre-allocated arrays of the dictionary 'out'. Normalised data and mask are
+    only saved if 'out' has the corresponding keys. Channel ranges are independent,
+    and can be processed concurrently. """
+    with profiler.stage('normalise'):
+        ndata, med, std = normalise_block(data[:, chans])
+        ndata = np.ascontiguousarray(ndata.T)
+    with profiler.stage('convolve'):
+        conv = convolver.process_block(ndata.T)
+    with profiler.stage('mask'):
+        mask = _occupancy_mask(conv, convolver.widths, thr=thr)
+    del conv
+    with profiler.stage('aggregate'):
+        if 'ndata' in out:
+            out['ndata'][chans] = ndata
+            out['mask'][chans] = mask
+        out['median'][chans] = med
+        out['robust_std'][chans] = std
+        out['avg_power'][chans] = (ndata**2).mean(axis=1)
+        out['occupancy'][chans] = mask.mean(axis=1)
+
+
+def analyse_block(data, wmax=256, wtsp=2.0, thr=6.0, chunksize=256, engine='auto', precision='float32', fft_workers=1, padlen=None, nthreads=1, executor=None, stats_only=False, out=None, as_dataframe=False, profiler=None):
     """ Compute a number of statistics of a 2D data block. 
    
     Parameters:
@@ -113,27 +243,88 @@ def analyse_block(data, wmax=256, wtsp=2.0, thr=6.0):
         thr: float
             Minimum S/N of a pulse for it to be considered
             statistically significant.
+        chunksize: int
+            Number of channels processed at once. Larger values mean fewer,
+            larger FFTs at the expense of memory usage.
+        engine: str
+            Boxcar convolution engine, see BoxcarConvolver.
+        precision: str
+            Floating point type of the convolution products, 'float32' or 'float64'.
+            float32 halves the memory footprint and bandwidth of the convolution and
+            occupancy mask stages. Rounding of the S/N values to float32 may flip pulses
+            whose S/N is within ~1e-6 of the threshold, or of a competing pulse: the
+            resulting occupancy differences are negligible, see README.
+        fft_workers: int
+            Number of threads used by each FFT, when using the 'fft' engine.
+        padlen: int or None
+            Length to which the data are zero-padded before FFT convolution, see
+            BoxcarConvolver. None means automatic.
+        nthreads: int
+            Number of threads processing chunks of channels in parallel. Most of the
+            work happens in numpy calls that release the GIL.
+        executor: concurrent.futures.Executor or None
+            Thread pool to process chunks of channels with, in place of one created
+            for this call with 'nthreads' threads. Used to share a single pool between
+            the blocks of a file.
+        stats_only: bool
+            If True, only compute the per-channel statistics. The normalised data
+            and mask of the whole block are never stored, and None is returned in
+            their place. Peak memory usage is then that of a chunk of channels.
+        out: dict or None
+            Optional dictionary {stat_name: ndarray} of pre-allocated 1D arrays of
+            length num_channels, into which the statistics are written. It must
+            contain all keys listed in STATS_KEYS. This is typically a dict of rows
+            of larger (num_blocks, num_channels) arrays.
+        as_dataframe: bool
+            If True, return the statistics as a pandas.DataFrame with columns STATS_KEYS,
+            like earlier versions did by default (requires pandas).
+        profiler: Profiler or None
+            If specified, the time spent in each stage of the analysis is added to it.
             
     Returns:
     --------
-        ndata: ndarray
+        ndata: ndarray or None
             Normalised data block TRANSPOSED, i.e. shape is (num_channels, num_samples)
-        mask: ndarray
+        mask: ndarray or None
             Bitmask of same shape as ndata. True for any data point that is part of a
             statistically significant pulse.
-        stats: pandas.DataFrame
-            Segment statistics per channel.
+        stats: dict or pandas.DataFrame
+            Segment statistics per channel, as a dictionary {stat_name: ndarray}.
+            This is 'out' if it was specified. A DataFrame if 'as_dataframe' is True.
     
     """
     nsamp, nchan = data.shape
-    convolver = BoxcarConvolver(nsamp, wmax=wmax, wtsp=wtsp)
-    output = [analyse_segment(channel, convolver, thr=thr) for channel in data.T]
-    
-    mask  = np.asarray([dic['mask']  for dic in output])
-    ndata = np.asarray([dic['ndata'] for dic in output])
-
-    columns = [
-        'median', 'robust_std', 'avg_power', 'occupancy'
-        ]
-    stats = pandas.DataFrame(output, columns=columns)
-    return ndata, mask, stats
+    convolver = get_convolver(nsamp, wmax=wmax, wtsp=wtsp, engine=engine, precision=precision, workers=fft_workers, padlen=padlen)
+
+    dtype = _normalised_dtype(data)
+    if out is None:
+        out = {
+            'median' : np.empty(nchan, dtype=dtype),
+            'robust_std' : np.empty(nchan, dtype=dtype),
+            'avg_power' : np.empty(nchan, dtype=dtype),
+            'occupancy' : np.empty(nchan, dtype=np.float64),
+            }
+    stats = out
+    out = dict(stats)
+    if not stats_only:
+        out['ndata'] = np.empty((nchan, nsamp), dtype=dtype)
+        out['mask'] = np.empty((nchan, nsamp), dtype=bool)
+
+    chunksize = max(1, int(chunksize))
+    shards = [slice(ichan, ichan + chunksize) for ichan in range(0, nchan, chunksize)]
+    profiler = profiler or NULL_PROFILER
+    analyse_shard = lambda chans: _analyse_channels(data, chans, convolver, thr, out, profiler)
+    if executor is not None and len(shards) > 1:
+        # Consume the iterator to propagate any exception
+        list(executor.map(analyse_shard, shards))
+    elif nthreads > 1 and len(shards) > 1:
+        with ThreadPoolExecutor(max_workers=int(nthreads)) as pool:
+            list(pool.map(analyse_shard, shards))
+    else:
+        for chans in shards:
+            analyse_shard(chans)
+
+    if as_dataframe:
+        import pandas
+        stats = pandas.DataFrame({key: stats[key] for key in STATS_KEYS})
+    return out.get('ndata'), out.get('mask'), stats
@@ -0,0 +1,44 @@
+### Standard library imports
+import argparse
+import glob
+
+### Local module imports
+from rfistats.catalog import StatsCatalog
+
+###############################################################################
+
+def parse_args():
+    """ Parse command line arguments with which the script was called. Returns
+    an object containing them all.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('catalog', type=str, help='Catalog HDF5 file, created if it does not exist.')
+    parser.add_argument('fnames', type=str, nargs='+', help='Stats HDF5 files to ingest. Glob patterns are expanded.')
+    parser.add_argument('--force', action='store_true', help='Ingest files again even if they have not changed since they were last ingested.')
+    parser.add_argument('--repack', action='store_true', help='Rewrite the catalog when done, to reclaim the space of entries replaced by re-ingested files.')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    fnames = []
+    for pattern in args.fnames:
+        fnames.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    with StatsCatalog(args.catalog) as catalog:
+        results = catalog.ingest_many(fnames, force=args.force)
+        for result in results:
+            if result['status'] == 'failed':
+                print('{fname:s}: failed ({error:s})'.format(**result))
+            elif result['status'] == 'skipped':
+                print('{fname:s}: skipped (catalog file)'.format(**result))
+            else:
+                print('{fname:s}: {status:s}'.format(**result))
+        if args.repack:
+            catalog.repack()
+        nfailed = sum(result['status'] == 'failed' for result in results)
+        print('Catalog {0:s} contains {1:d} entries, {2:d} files failed'.format(args.catalog, len(catalog), nfailed))
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
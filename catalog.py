@@ -0,0 +1,285 @@
+import os
+
+import numpy as np
+import h5py
+
+from rfistats.filterbank_stats import FilterbankStats, FilterbankStatsWriter
+
+# Per-channel summaries of every statistic, computed over all blocks of a file
+SUMMARIES = ('mean', 'median', 'p90', 'max')
+
+# Functions used to aggregate a per-channel summary across files
+AGGREGATES = {
+    'mean' : np.mean,
+    'median' : np.median,
+    'min' : np.min,
+    'max' : np.max,
+    }
+
+
+def channel_summaries(fstats, stat_name):
+    """ Compute all SUMMARIES of a statistic over time, in every channel. Data are read
+    in groups of channels matching the chunk shape of stats files, which works equally
+    well with in-memory and lazily loaded FilterbankStats. Returns a dict
+    {summary: 1D array}. """
+    data = getattr(fstats, stat_name)
+    nchan = fstats.nchan
+    summaries = {key: np.full(nchan, np.nan, dtype=np.float32) for key in SUMMARIES}
+    if not fstats.nblock:
+        return summaries
+
+    __, step = FilterbankStatsWriter.chunk_shape(nchan)
+    for ichan in range(0, nchan, step):
+        chans = slice(ichan, min(ichan + step, nchan))
+        x = np.asarray(data[:, chans], dtype=np.float32)
+        summaries['mean'][chans] = x.mean(axis=0, dtype=np.float64)
+        summaries['median'][chans], summaries['p90'][chans] = np.percentile(x, [50, 90], axis=0)
+        summaries['max'][chans] = x.max(axis=0)
+    return summaries
+
+
+class StatsCatalog(object):
+    """ Consolidates the output of analyse_filterbank() for many observations into a
+    single HDF5 file, so that band usability can be queried without opening the
+    original stats files.
+
+    Every ingested file gets an entry storing its metadata (header attributes, analysis
+    parameters, frequency range, number of blocks), channel frequencies, and per-channel
+    summaries over time of every statistic (see SUMMARIES). Entries are identified by
+    the absolute path of the stats file, along with its size and modification time:
+    ingesting a file that has not changed does nothing, and a file that has changed
+    replaces its previous entry. """
+    def __init__(self, fname, mode='a'):
+        """
+        Parameters:
+        -----------
+            fname: str
+                Catalog file name.
+            mode: str
+                h5py file mode, 'a' to create or append, 'r' for read-only queries.
+        """
+        self.fname = fname
+        self.file = h5py.File(fname, mode)
+        if not 'entries' in self.file:
+            self.file.create_group('entries')
+
+        # Map stats file path -> entry name
+        self._index = {
+            group.attrs['path']: name
+            for name, group in self.file['entries'].items()
+            }
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, fname):
+        """ True if the file is in the catalog, and has not changed since it was ingested. """
+        path = os.path.abspath(fname)
+        name = self._index.get(path)
+        if name is None:
+            return False
+        attrs = self.file['entries'][name].attrs
+        return attrs['file_size'] == os.path.getsize(path) and attrs['file_mtime'] == os.path.getmtime(path)
+
+    def ingest(self, fname, force=False):
+        """ Add a stats file to the catalog, unless it is already there and unchanged.
+        Returns True if the file was ingested, False if it was skipped. Raises
+        ValueError if fname is the catalog file itself, and OSError or KeyError if it
+        cannot be read as a stats file, in which case the catalog is left unchanged.
+
+        A changed file replaces its previous entry, but HDF5 does not reclaim the space
+        the old entry used: see repack(). """
+        path = os.path.abspath(fname)
+        if path == os.path.abspath(self.fname):
+            raise ValueError('Cannot ingest the catalog file into itself')
+        if not force and path in self:
+            return False
+
+        # Read everything before modifying the catalog, so that an unreadable file
+        # does not remove its previous entry
+        with FilterbankStats.load_hdf5(path, lazy=True) as fstats:
+            attrs = {}
+            with h5py.File(path, 'r') as fobj:
+                for group_name in ('header', 'params', 'progress'):
+                    if group_name in fobj:
+                        attrs.update(fobj[group_name].attrs)
+            attrs.update({
+                'path' : path,
+                'file_size' : os.path.getsize(path),
+                'file_mtime' : os.path.getmtime(path),
+                'nblock' : fstats.nblock,
+                'nchan' : fstats.nchan,
+                'fmin' : fstats.freqs.min() if fstats.nchan else np.nan,
+                'fmax' : fstats.freqs.max() if fstats.nchan else np.nan,
+                })
+            freqs = fstats.freqs
+            summaries = {
+                stat_name: channel_summaries(fstats, stat_name)
+                for stat_name in fstats.stats_keys
+                }
+
+        entries = self.file['entries']
+        name = self._index.get(path)
+        if name is not None:
+            del entries[name]
+        else:
+            name = '{0:06d}'.format(int(entries.attrs.get('next_id', 0)))
+            entries.attrs['next_id'] = int(name) + 1
+
+        group = entries.create_group(name)
+        group.attrs.update(attrs)
+        group.create_dataset('freqs', data=freqs, dtype=np.float64)
+        for stat_name, stat_summaries in summaries.items():
+            stat_group = group.create_group(stat_name)
+            for summary, values in stat_summaries.items():
+                stat_group.create_dataset(summary, data=values)
+
+        self._index[path] = name
+        self.file.flush()
+        return True
+
+    def ingest_many(self, fnames, force=False):
+        """ Ingest several stats files, see ingest(). The catalog file itself is
+        skipped, e.g. when matched by a glob pattern along with the stats files, and a
+        file that cannot be ingested does not prevent the others from being ingested.
+
+        Returns:
+        --------
+            results: list
+                One dict per file, with keys 'fname', 'status' ('ingested', 'unchanged',
+                'skipped' for the catalog file, or 'failed') and 'error' (None, or the
+                error message of a failed file).
+        """
+        results = []
+        for fname in fnames:
+            result = {'fname': fname, 'status': None, 'error': None}
+            if os.path.abspath(fname) == os.path.abspath(self.fname):
+                result['status'] = 'skipped'
+            else:
+                try:
+                    result['status'] = 'ingested' if self.ingest(fname, force=force) else 'unchanged'
+                except (OSError, KeyError, ValueError) as err:
+                    result.update({'status': 'failed', 'error': '{0:s}: {1!s}'.format(type(err).__name__, err)})
+            results.append(result)
+        return results
+
+    def repack(self):
+        """ Rewrite the catalog file with its current entries only. HDF5 does not
+        reclaim the space of deleted objects, so a catalog where many entries were
+        replaced (changed files, or force=True) keeps growing until repacked. The
+        catalog must be open in a writable mode. """
+        mode = self.file.mode
+        if mode == 'r':
+            raise ValueError('The catalog must be open in a writable mode to be repacked')
+        tmpname = '{0:s}.{1:d}.tmp'.format(self.fname, os.getpid())
+        with h5py.File(tmpname, 'w') as fobj:
+            self.file.copy(self.file['entries'], fobj, name='entries')
+        self.file.close()
+        os.replace(tmpname, self.fname)
+        self.file = h5py.File(self.fname, 'a')
+
+    def select(self, fmin=None, fmax=None, mjd_min=None, mjd_max=None, source_name=None, complete_only=True, where=None):
+        """ Returns the names of the entries matching all the given criteria.
+
+        Parameters:
+        -----------
+            fmin, fmax: float or None
+                Frequency range, the band of selected entries must lie within it.
+            mjd_min, mjd_max: float or None
+                Range of observation start MJDs.
+            source_name: str or None
+                Source name.
+            complete_only: bool
+                If True, ignore entries of partial (interrupted or ongoing) analyses.
+            where: callable or None
+                Function taking the metadata dict of an entry, and returning True if
+                it should be selected.
+        """
+        names = []
+        for name, group in self.file['entries'].items():
+            attrs = dict(group.attrs)
+            mjd = attrs.get('mjd_start', np.nan)
+            criteria = [
+                fmin is None or attrs['fmin'] >= fmin,
+                fmax is None or attrs['fmax'] <= fmax,
+                mjd_min is None or mjd >= mjd_min,
+                mjd_max is None or mjd <= mjd_max,
+                source_name is None or attrs.get('source_name') == source_name,
+                not complete_only or attrs.get('complete', True),
+                where is None or where(attrs),
+                ]
+            if all(criteria):
+                names.append(name)
+        return names
+
+    def metadata(self, name):
+        """ Metadata of an entry, as a dict. """
+        return dict(self.file['entries'][name].attrs)
+
+    def entries(self, **selection):
+        """ Metadata of all entries matching the selection criteria accepted by
+        select(), as a list of dicts. """
+        return [self.metadata(name) for name in self.select(**selection)]
+
+    def channel_summary(self, name, stat_name='occupancy', summary='mean'):
+        """ Returns channel frequencies and per-channel summary of a statistic, for
+        one entry. """
+        group = self.file['entries'][name]
+        return group['freqs'][()], group[stat_name][summary][()]
+
+    def channel_aggregate(self, stat_name='occupancy', summary='mean', how='median', **selection):
+        """ Aggregate a per-channel summary of a statistic across all entries matching
+        the selection criteria accepted by select(). All entries selected must have the
+        same channel frequencies.
+
+        Parameters:
+        -----------
+            stat_name: str
+                Name of the statistic, e.g. 'occupancy'.
+            summary: str
+                Summary of the statistic over time, in every file. One of SUMMARIES.
+            how: str
+                Function used to aggregate summaries across files, one of 'mean',
+                'median', 'min' or 'max'.
+            **selection:
+                Selection criteria, see select().
+
+        Returns:
+        --------
+            freqs: ndarray
+                Channel frequencies.
+            values: ndarray
+                Aggregated values, one per channel.
+            names: list
+                Names of the entries aggregated.
+        """
+        if not summary in SUMMARIES:
+            raise ValueError('summary must be one of {0!r}'.format(SUMMARIES))
+        if not how in AGGREGATES:
+            raise ValueError('how must be one of {0!r}'.format(sorted(AGGREGATES)))
+
+        names = self.select(**selection)
+        if not names:
+            raise ValueError('No catalog entry matches the selection criteria')
+
+        freqs = None
+        values = []
+        for name in names:
+            entry_freqs, entry_values = self.channel_summary(name, stat_name, summary)
+            if freqs is None:
+                freqs = entry_freqs
+            elif not np.array_equal(freqs, entry_freqs):
+                raise ValueError(
+                    'Entries {0!r} and {1!r} have different channel frequencies, narrow down the selection'.format(names[0], name))
+            values.append(entry_values)
+        return freqs, AGGREGATES[how](values, axis=0), names
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
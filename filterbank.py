@@ -1,6 +1,7 @@
 import numpy
 import struct
 import os
+import warnings
 
 from rfistats.sigproc_header import SigprocHeader
 
@@ -17,12 +18,48 @@ class Filterbank(object):
         fobj.seek(0, 2) # Seek to the end of the file
         self._bytesize = fobj.tell()
         fobj.close()
+        self._memmap = None
 
     def sample_offset(self, isamp):
         """ Byte offset in the file where sample number 'isamp' is stored.
         """
         return self.data_offset_start + isamp * self.bytes_per_sample
     
+    @property
+    def dtype(self):
+        """ numpy type of the data as stored in the file. """
+        if self.nbits == 32:
+            return numpy.dtype(numpy.float32)
+        if self.nbits == 8:
+            if not 'signed' in self._header:
+                warnings.warn("Filterbank header does NOT specify 8-bit signedness ! Assuming *signed* 8-bit data.")
+                return numpy.dtype(numpy.int8)
+            return numpy.dtype(numpy.int8 if self._header['signed'] else numpy.uint8)
+        raise ValueError('Only 8-bit and 32-bit filterbanks are supported')
+
+    @property
+    def memmap(self):
+        """ Read-only memory map of the whole data, with shape (nsamp, nchans).
+        Nothing is read from disk until the data are accessed. """
+        if self._memmap is None:
+            self._memmap = numpy.memmap(
+                self.fname, dtype=self.dtype, mode='r', offset=self.data_offset_start,
+                shape=(self.nsamp, self.nchans))
+        return self._memmap
+
+    def get_samples(self, start, end, out=None):
+        """ Get data samples in the index range [start, end), as an array of shape
+        (end - start, nchans). If 'out' is None, the output is a zero-copy view of the
+        file's memory map. Otherwise, the data are converted and copied into 'out',
+        which must have the appropriate shape. """
+        start = max(0, int(start))
+        end = min(int(end), self.nsamp)
+        view = numpy.asarray(self.memmap[start:end])
+        if out is None:
+            return view
+        numpy.copyto(out, view, casting='unsafe')
+        return out
+
     @property
     def source_name(self):
         return self._header['source_name']
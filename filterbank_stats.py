@@ -1,9 +1,19 @@
+import mmap
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import h5py
-import warnings
 
 from rfistats.filterbank import Filterbank
-from rfistats.block_stats import analyse_block
+from rfistats.block_stats import analyse_block, STATS_KEYS
+from rfistats.pyramid import REDUCTIONS, TimePyramidBuilder, reduce_pairs
+from rfistats.profiling import BLOCK_ARRAYS, NULL_PROFILER, Profiler
+from rfistats.progress import ProgressReporter
 
 
 class DataBlock(object):
@@ -57,11 +67,85 @@ class DataBlock(object):
 
 
 
+def _read_block(filterbank, isamp, gulp, out, io_stats):
+    """ Read 'gulp' samples starting at 'isamp', and update the I/O statistics. """
+    t = time.perf_counter()
+    data = filterbank.get_samples(isamp, isamp + gulp, out=out)
+    io_stats['read_time'] += time.perf_counter() - t
+    io_stats['bytes_read'] += gulp * filterbank.bytes_per_sample
+    return data
+
+
+def _fault_in(data):
+    """ Read one byte of every memory page of a data block. Blocks are usually zero-copy
+    views of a memory map, whose pages are only read from disk when first accessed. When
+    profiling, this moves the I/O into the 'read' stage, instead of the first stage of
+    the analysis that touches the data. """
+    pages = np.ascontiguousarray(data).reshape(-1).view(np.uint8)[::mmap.PAGESIZE]
+    return int(pages.sum())
+
+
+def _put(item, queue_, halt):
+    """ Put an item in the prefetch queue. Returns False if 'halt' was set while
+    waiting for a free slot. """
+    while not halt.is_set():
+        try:
+            queue_.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _prefetch_loop(filterbank, gulp, block_starts, ring, queue_, halt, io_stats):
+    """ Prefetch thread main loop: read all blocks in order into the ring of buffers and
+    put them in the queue, followed by None. Any exception is forwarded to the consumer.
+    It deliberately takes no reference to the FilterbankIterator, see its __del__(). """
+    try:
+        for iblock, isamp in enumerate(block_starts):
+            buf = ring[iblock % len(ring)]
+            item = (isamp, _read_block(filterbank, isamp, gulp, buf, io_stats))
+            if not _put(item, queue_, halt):
+                return
+    except Exception as err:
+        _put(err, queue_, halt)
+        return
+    _put(None, queue_, halt)
+
+
 class FilterbankIterator(object):
-    """ """
+    """ Iterate through a filterbank file in blocks of 'gulp' samples. Data are read
+    through a memory map: 32-bit data blocks (and 8-bit blocks if native_dtype is True)
+    are zero-copy views of the file. 8-bit blocks cast to float32 are written into a
+    buffer that is re-used for every block, i.e. a block's data are only valid until
+    the next block is requested.
+
+    In prefetch mode, a background thread reads the next blocks into a ring of
+    pre-allocated buffers while the current one is being processed. The same validity
+    rule applies. The thread is stopped by close(), when leaving a 'with' block, or when
+    the iterator is garbage collected. """
     _GULP_MIN = 16
     
-    def __init__(self, filterbank, gulp=1024, start=0, end=None):
+    def __init__(self, filterbank, gulp=1024, start=0, end=None, native_dtype=False, prefetch=0):
+        """
+        Parameters:
+        -----------
+            filterbank: str or Filterbank
+                Input filterbank, or path to it.
+            gulp: int
+                Number of samples per data block.
+            start: int
+                Start sample index.
+            end: int or None
+                End sample index. If None, iterate until the end of the file.
+            native_dtype: bool
+                If True, 8-bit data are returned as int8 or uint8, which takes 4x less
+                memory than casting them to float32, and lets analyse_block() compute
+                their statistics from histograms. 32-bit data are always float32.
+            prefetch: int
+                Number of blocks read ahead by a background thread. 0 disables
+                prefetching.
+        """
         if type(filterbank) == str:
             self.filterbank = Filterbank(filterbank)
         else:
@@ -70,16 +154,10 @@ class FilterbankIterator(object):
         if self.filterbank.nbits not in {8, 32}:
             raise ValueError('Only 8-bit and 32-bit filterbanks are supported')
 
-        self.dtype = np.float32
-        if self.filterbank.nbits == 8:
-            if not 'signed' in self.filterbank._header:
-                warnings.warn("Filterbank header does NOT specify 8-bit signedness ! Assuming *signed* 8-bit data.")
-                self.dtype = np.int8
-            else:
-                signed = self.filterbank._header['signed']
-                self.dtype = np.int8 if signed else np.uint8
-
+        self.dtype = self.filterbank.dtype
         self.gulp = max(self._GULP_MIN, int(gulp))
+        self.native_dtype = bool(native_dtype)
+        self.prefetch = max(0, int(prefetch))
         
         # Define bounds
         if end is None:
@@ -91,44 +169,241 @@ class FilterbankIterator(object):
         self.start = min(self.start, self.end)
         
         self.isamp = self.start
-        self.file = open(self.filterbank.fname, 'rb')
-        self.file.seek(
-            self.filterbank.sample_offset(self.isamp)
-            )
-        
+        self.io_stats = {
+            'blocks' : 0,
+            'bytes_read' : 0,
+            'read_time' : 0.0,
+            'wait_time' : 0.0,
+            }
+
+        # Conversion buffer, only needed to cast 8-bit data to float32
+        self._buffer = None
+        if self.dtype != np.float32 and not self.native_dtype:
+            self._buffer = np.empty((self.gulp, self.filterbank.nchans), dtype=np.float32)
+
+        # Prefetch thread and associated ring of buffers. The consumer holds one buffer
+        # and the queue up to 'prefetch', while the thread fills another.
+        self._thread = None
+        self._queue = None
+        self._halt = threading.Event()
+        if self.prefetch:
+            dtype = self.dtype if self.native_dtype else np.float32
+            self._ring = [
+                np.empty((self.gulp, self.filterbank.nchans), dtype=dtype)
+                for __ in range(self.prefetch + 2)
+                ]
+
     def __iter__(self):
         return self
-    
-    def __next__(self):
-        nchan = self.filterbank.nchans
-        # Don't forget to cast to float32 after reading
-        data = np.fromfile(self.file, dtype=self.dtype, count=nchan*self.gulp).astype(np.float32)
-        nsr = data.size // nchan
-        self.isamp += nsr
-        if nsr < self.gulp or self.isamp > self.end:
-            self.file.close()
+
+    def skip(self, nblock):
+        """ Skip the next 'nblock' blocks without reading them. """
+        self.isamp = min(self.isamp + int(nblock) * self.gulp, self.end)
+
+    @property
+    def block_starts(self):
+        """ Start sample indices of the blocks that remain to be returned. """
+        return range(self.isamp, self.end - self.gulp + 1, self.gulp)
+
+    def _read(self, isamp, out):
+        return _read_block(self.filterbank, isamp, self.gulp, out, self.io_stats)
+
+    def close(self):
+        """ Stop the prefetch thread, if any. """
+        self._halt.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # The prefetch thread holds no reference to the iterator, which can therefore
+        # be garbage collected while the thread runs, e.g. after breaking out of a loop
+        # over its blocks. The thread then exits within its polling interval.
+        halt = getattr(self, '_halt', None)
+        if halt is not None:
+            halt.set()
+
+    def _next_prefetched(self):
+        if self._thread is None:
+            self._queue = queue.Queue(maxsize=self.prefetch)
+            args = (self.filterbank, self.gulp, list(self.block_starts), self._ring, self._queue, self._halt, self.io_stats)
+            self._thread = threading.Thread(target=_prefetch_loop, args=args, daemon=True)
+            self._thread.start()
+
+        t = time.perf_counter()
+        item = self._queue.get()
+        self.io_stats['wait_time'] += time.perf_counter() - t
+
+        if item is None:
+            self.close()
             raise StopIteration
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        return item
+
+    def __next__(self):
+        if self.prefetch:
+            isamp, data = self._next_prefetched()
         else:
-            data = data.reshape(nsr, nchan)
-            times = np.arange(self.isamp, self.isamp + nsr) * self.filterbank.tsamp
-            return DataBlock(data, times=times, freqs=self.filterbank.freqs, tsamp=self.filterbank.tsamp)
+            # Only full blocks are returned
+            if self.isamp + self.gulp > self.end:
+                raise StopIteration
+            isamp, data = self.isamp, self._read(self.isamp, self._buffer)
+
+        times = np.arange(isamp, isamp + self.gulp) * self.filterbank.tsamp
+        self.isamp = isamp + self.gulp
+        self.io_stats['blocks'] += 1
+        return DataBlock(data, times=times, freqs=self.filterbank.freqs, tsamp=self.filterbank.tsamp)
+
+
+
+
+class LazyDataset(object):
+    """ Read-only, array-like proxy to a 2D HDF5 dataset, that only reads from disk the
+    parts of the data being accessed. Slicing returns numpy arrays, and np.asarray()
+    loads the whole dataset. """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def ndim(self):
+        return self.dataset.ndim
+
+    @property
+    def size(self):
+        return self.dataset.size
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.dataset[index]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.dataset[()]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def mean(self, axis=None):
+        """ Mean along given axis. Along axis 0, the data are read in blocks of rows
+        matching the dataset's chunk shape, so that memory usage stays low. """
+        if axis != 0:
+            return np.asarray(self).mean(axis=axis)
+        nrows = self.shape[0]
+        step = self.dataset.chunks[0] if self.dataset.chunks else nrows
+        total = np.zeros(self.shape[1:])
+        for irow in range(0, nrows, max(step, 1)):
+            total += self.dataset[irow:irow+step].sum(axis=0, dtype=np.float64)
+        return (total / nrows).astype(self.dtype)
+
+    def __repr__(self):
+        return '{0:s}(shape={1!r}, dtype={2!s})'.format(type(self).__name__, self.shape, self.dtype)
 
 
 
 
 class FilterbankStats(object):
     """  """
-    def __init__(self, tsamp, freqs, gulp, times, stats_dict):
+    def __init__(self, tsamp, freqs, gulp, times, stats_dict, params=None, metadata=None, complete=True, profile=None):
         self.times = np.asarray(times)
         self.freqs = np.asarray(freqs)
         self.tsamp = tsamp
         self.gulp = gulp
         self.stats_keys = list(stats_dict.keys())
+        # Analysis parameters, extra information about the input data, and whether
+        # the analysis was run to completion
+        self.params = dict(params or {})
+        self.metadata = dict(metadata or {})
+        self.complete = bool(complete)
+        # Profiling summary of the analysis, see profiling.Profiler.summary()
+        self.profile = profile
+        self._file = None
+        # Coarse resolution levels available in the input file, and caches
+        self._stored_levels = {}
+        self._resolutions = {}
+        self._time_averages = {}
         for key, val in stats_dict.items():
-            setattr(self, key, np.asarray(val))
+            if not isinstance(val, LazyDataset):
+                val = np.asarray(val)
+            setattr(self, key, val)
+
+    def close(self):
+        """ Close the underlying HDF5 file, if loaded in lazy mode. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
             
     def time_average(self, stat_name):
-        return getattr(self, stat_name).mean(axis=0)
+        """ Average of a statistic over all blocks, in every channel. Results are cached,
+        statistics must therefore not be modified once the object is created. """
+        if not stat_name in self._time_averages:
+            self._time_averages[stat_name] = getattr(self, stat_name).mean(axis=0)
+        return self._time_averages[stat_name]
+
+    def at_resolution(self, level, reduction='mean'):
+        """ Returns a FilterbankStats object where every statistic is reduced over
+        bins of 2^level consecutive blocks, discarding any trailing incomplete bin.
+        If the object was loaded from a file that contains this level of the time
+        pyramid (see FilterbankStatsWriter), it is read from there without touching
+        the full resolution data. Otherwise it is computed, and cached.
+
+        Parameters:
+        -----------
+            level: int
+                Decimation level, 0 being the full resolution.
+            reduction: str
+                Either 'mean' or 'max'.
+
+        Returns:
+        --------
+            fstats: FilterbankStats
+                Coarse statistics, with a gulp 2^level times larger.
+        """
+        level = int(level)
+        if level < 0:
+            raise ValueError('level must be >= 0')
+        if not reduction in REDUCTIONS:
+            raise ValueError('reduction must be one of {0!r}'.format(REDUCTIONS))
+        if level == 0:
+            return self
+
+        key = (level, reduction)
+        if not key in self._resolutions:
+            if level in self._stored_levels:
+                times, stats = self._stored_levels[level]
+                stats = stats[reduction]
+            else:
+                finer = self.at_resolution(level - 1, reduction)
+                times = finer.times[0:2*(finer.nblock // 2):2]
+                stats = {
+                    name: reduce_pairs(getattr(finer, name), reduction)
+                    for name in self.stats_keys
+                    }
+            self._resolutions[key] = FilterbankStats(
+                self.tsamp, self.freqs, self.gulp * 2**level, times, stats, metadata=self.metadata, complete=self.complete)
+        return self._resolutions[key]
         
     @property
     def nblock(self):
@@ -151,56 +426,693 @@ class FilterbankStats(object):
 
     def save_hdf5(self, fname):
         """ Save FilterbankStats object to HDF5 format. """
-        with h5py.File(fname, 'w') as fobj:
-            # Header stores time stamps, freqs, and other basic data about the
-            # filterbank analysed
-            header_group = fobj.create_group('header')
-            header_group.attrs.update({
-                'tsamp' : self.tsamp,
-                'gulp' : self.gulp,
-                })
-            header_group.create_dataset('times', data=self.times, dtype=np.float64, compression='gzip')       
-            header_group.create_dataset('freqs', data=self.freqs, dtype=np.float64, compression='gzip')
-
-            # stats_group stores all statistics collected as 2D arrays
-            stats_group = fobj.create_group('stats')
-            for key in self.stats_keys:
-                data = getattr(self, key)
-                stats_group.create_dataset(key, data=data, dtype=np.float64, compression='gzip')            
+        stats = {key: getattr(self, key) for key in self.stats_keys}
+        writer = FilterbankStatsWriter(
+            fname, self.tsamp, self.freqs, self.gulp, self.stats_keys, params=self.params, metadata=self.metadata)
+        with writer:
+            writer.extend(self.times, stats)
+            if self.profile is not None:
+                writer.write_profile(self.profile)
+
+    @classmethod
+    def merge(cls, fstats_list):
+        """ Concatenate the statistics of consecutive ranges of the same filterbank file,
+        e.g. the outputs of an analysis split into shards (see shards.plan_shards()).
+        Consistency of channel frequencies, sampling time, gulp, statistics and analysis
+        parameters is checked, and a ValueError raised if anything differs or if the
+        ranges are not contiguous.
+
+        Returns:
+        --------
+            fstats: FilterbankStats
+                Merged statistics, loaded in memory.
+        """
+        params = check_mergeable(fstats_list)
+        first = fstats_list[0]
+        times = np.concatenate([fstats.times for fstats in fstats_list])
+        stats = {
+            key: np.concatenate([np.asarray(getattr(fstats, key)) for fstats in fstats_list])
+            for key in first.stats_keys
+            }
+        return cls(first.tsamp, first.freqs, first.gulp, times, stats, params=params, metadata=first.metadata)
     
     @classmethod
-    def load_hdf5(cls, fname):
-        """ Load FilterbankStats object from HDF5 file."""
-        with h5py.File(fname, 'r') as fobj:
+    def load_hdf5(cls, fname, lazy=False):
+        """ Load FilterbankStats object from HDF5 file.
+
+        If 'lazy' is True, statistics are not loaded in memory. They are LazyDataset
+        proxies instead, which only read the data being sliced. The file then remains
+        open until close() is called, or the object is used as a context manager.
+        The time pyramid stored in the file, if any, is then used by at_resolution(). """
+        fobj = h5py.File(fname, 'r')
+        try:
             header_group = fobj['header']
             tsamp = header_group.attrs['tsamp']
             gulp = header_group.attrs['gulp']
 
-            times = header_group['times'].value
-            freqs = header_group['freqs'].value
+            times = header_group['times'][()]
+            freqs = header_group['freqs'][()]
+
+            metadata = {
+                key: val for key, val in header_group.attrs.items()
+                if not key in ('tsamp', 'gulp')
+                }
+            params = dict(fobj['params'].attrs) if 'params' in fobj else {}
+            complete = bool(fobj['progress'].attrs['complete']) if 'progress' in fobj else True
+            profile = None
+            if 'profile' in fobj:
+                profile = dict(fobj['profile'].attrs)
+                for key, dataset in fobj['profile'].items():
+                    profile[key] = dataset[()]
 
             stats_group = fobj['stats']
             stats_dict = {
-                key: dataset.value
+                key: LazyDataset(dataset) if lazy else dataset[()]
                 for key, dataset in stats_group.items()
                 }    
-        return cls(tsamp, freqs, gulp, times, stats_dict)
-        
 
-    
-    
-def analyse_filterbank(fname, start=0, end=None, gulp=2048, wmax=128, wtsp=2.0, thr=6.0):
+            stored_levels = {}
+            if lazy and 'pyramid' in fobj:
+                for level in range(1, fobj['pyramid'].attrs['nlevels'] + 1):
+                    level_group = fobj['pyramid'][str(level)]
+                    stats = {
+                        reduction: {
+                            key: LazyDataset(dataset)
+                            for key, dataset in level_group[reduction].items()
+                            }
+                        for reduction in REDUCTIONS
+                        }
+                    stored_levels[level] = (level_group['times'][()], stats)
+        except:
+            fobj.close()
+            raise
+
+        fstats = cls(
+            tsamp, freqs, gulp, times, stats_dict, params=params, metadata=metadata, complete=complete, profile=profile)
+        fstats._stored_levels = stored_levels
+        if lazy:
+            fstats._file = fobj
+        else:
+            fobj.close()
+        return fstats
+
+
+
+
+def check_mergeable(fstats_list):
+    """ Check that a list of FilterbankStats can be merged, see FilterbankStats.merge().
+    Raises ValueError otherwise. Returns the analysis parameters of the merged output. """
+    if not fstats_list:
+        raise ValueError('Nothing to merge')
+
+    first = fstats_list[0]
+    # Start and end sample indices are the only parameters allowed to differ
+    ignored = ('start', 'end')
+    reference = {key: val for key, val in first.params.items() if not key in ignored}
+    for index, fstats in enumerate(fstats_list):
+        if not fstats.complete:
+            raise ValueError('Input #{0:d} is the output of an unfinished analysis'.format(index))
+        if not np.array_equal(fstats.freqs, first.freqs):
+            raise ValueError('Input #{0:d} has different channel frequencies'.format(index))
+        if fstats.tsamp != first.tsamp or fstats.gulp != first.gulp:
+            raise ValueError('Input #{0:d} has a different sampling time or gulp'.format(index))
+        if sorted(fstats.stats_keys) != sorted(first.stats_keys):
+            raise ValueError('Input #{0:d} has different statistics'.format(index))
+        params = {key: val for key, val in fstats.params.items() if not key in ignored}
+        mismatched = sorted(
+            key for key in set(params) | set(reference)
+            if params.get(key) != reference.get(key)
+            )
+        if mismatched:
+            raise ValueError('Input #{0:d} has different parameters: {1}'.format(index, ', '.join(mismatched)))
+
+    # Sample ranges must follow each other without gaps
+    for index, (prev, fstats) in enumerate(zip(fstats_list[:-1], fstats_list[1:]), 1):
+        if 'start' in fstats.params and 'end' in prev.params:
+            contiguous = fstats.params['start'] == prev.params['end']
+        elif prev.nblock and fstats.nblock:
+            contiguous = np.isclose(fstats.times[0], prev.times[-1] + prev.gulp * prev.tsamp)
+        else:
+            contiguous = True
+        if not contiguous:
+            raise ValueError('Input #{0:d} does not start where input #{1:d} ends'.format(index, index - 1))
+
+    params = dict(first.params)
+    if 'end' in fstats_list[-1].params:
+        params['end'] = fstats_list[-1].params['end']
+    return params
+
+
+
+
+class FilterbankStatsWriter(object):
+    """ Writes FilterbankStats to an HDF5 file incrementally, one block of statistics
+    at a time, so that results reach the disk while the analysis is running. The file
+    layout is the same as that of FilterbankStats.save_hdf5(), and can be read with
+    FilterbankStats.load_hdf5() at any time after a flush.
+
+    Blocks are buffered in memory and written every 'flush_every' blocks, which is also
+    the number of rows of the dataset chunks: every compressed chunk is thus written
+    once, rather than decompressed and rewritten at every flush.
+
+    The file also records the analysis parameters and the number of blocks safely
+    written, which allows resuming an interrupted analysis.
+
+    A time pyramid is built along the way: group 'pyramid/<k>' stores the mean and max
+    of every statistic over complete bins of 2^k blocks, for k = 1 to pyramid_levels,
+    which allows plotting long observations without reading the full resolution data.
+    It increases the file size by about 2x at most. """
+    # Chunk cache size. A whole row of chunks must fit in it, for appending blocks
+    # to be efficient.
+    _CHUNK_CACHE_BYTES = 32 * 2**20
+
+    def __init__(self, fname, tsamp, freqs, gulp, stats_keys=STATS_KEYS, flush_every=256, params=None, resume=False, compression='lzf', pyramid_levels=10, metadata=None):
+        """
+        Parameters:
+        -----------
+            fname: str
+                Output file name. Any existing file is overwritten, unless resuming.
+            tsamp: float
+                Sampling time of the filterbank analysed.
+            freqs: ndarray
+                Channel frequencies.
+            gulp: int
+                Number of samples per block.
+            stats_keys: list
+                Names of the statistics.
+            flush_every: int
+                Number of blocks buffered in memory before being written to disk,
+                rounded up to a power of two. It is also the number of rows of the
+                chunks of the statistics datasets (and of every level of the time
+                pyramid, divided by 2^level). An interrupted analysis loses at most
+                this many blocks. When resuming, the value of the existing file is used.
+            params: dict or None
+                Analysis parameters, saved as attributes of the 'params' group.
+            resume: bool
+                If True and the file exists, append to it rather than overwriting it.
+                Its parameters must match those given here, otherwise a ValueError is
+                raised. Any block written after the last recorded flush is discarded.
+            compression: str
+                Compression filter of the statistics datasets, applied after byte
+                shuffling: 'lzf' (fast, built into h5py), 'gzip' (smaller and
+                slower), or 'lz4' (requires the hdf5plugin package).
+            pyramid_levels: int
+                Number of levels of the time pyramid, 0 to disable it. When resuming,
+                the number of levels of the existing file is used instead.
+            metadata: dict or None
+                Extra information about the data analysed (e.g. source name, start
+                MJD), saved as attributes of the 'header' group.
+        """
+        self.fname = fname
+        self.stats_keys = list(stats_keys)
+        self.flush_every = 2**int(np.ceil(np.log2(max(1, int(flush_every)))))
+        self.params = {
+            key: val 
+            for key, val in dict(params or {}).items()
+            if val is not None
+            }
+        self.params.update({'tsamp': tsamp, 'gulp': gulp})
+        self.compression = compression
+        self._dataset_options = self._compression_options()
+        self.pyramid_levels = max(0, int(pyramid_levels))
+        self.metadata = dict(metadata or {})
+
+        self._times = []
+        self._rows = {key: [] for key in self.stats_keys}
+
+        resuming = resume and os.path.isfile(fname)
+        if resuming:
+            self._open_existing(freqs)
+        else:
+            self._create(tsamp, freqs, gulp)
+
+        # Completed coarse rows waiting to be written, for every pyramid level
+        self._pyramid = TimePyramidBuilder(self.pyramid_levels, self.stats_keys)
+        self._pyramid_rows = {level: [] for level in range(1, self.pyramid_levels + 1)}
+        if resuming:
+            self._replay_pyramid()
+
+    def _compression_options(self):
+        if self.compression == 'lz4':
+            try:
+                import hdf5plugin
+            except ImportError:
+                raise ImportError("LZ4 compression requires the 'hdf5plugin' package")
+            return dict(hdf5plugin.LZ4(), shuffle=True)
+        return dict(compression=self.compression, shuffle=True)
+
+    @staticmethod
+    def chunk_shape(nchan, rows=256):
+        """ Chunk shape of the 2D statistics datasets: 128 KB chunks of 'rows' blocks,
+        which is the number of blocks written at once. By default chunks span more blocks
+        than channels, to get reasonable performance when reading either a time series
+        for one channel, or all channels for a range of blocks. """
+        rows = max(1, int(rows))
+        cols = min(max(nchan, 1), max(1, 2**15 // rows))
+        return rows, cols
+
+    def _create(self, tsamp, freqs, gulp):
+        nchan = len(freqs)
+        self.file = h5py.File(self.fname, 'w', rdcc_nbytes=self._CHUNK_CACHE_BYTES)
+        # Header stores time stamps, freqs, and other basic data about the
+        # filterbank analysed
+        header_group = self.file.create_group('header')
+        header_group.attrs.update(self.metadata)
+        header_group.attrs.update({
+            'tsamp' : tsamp,
+            'gulp' : gulp,
+            })
+        header_group.create_dataset(
+            'times', shape=(0,), maxshape=(None,), chunks=(1024,), dtype=np.float64, compression='gzip')
+        header_group.create_dataset('freqs', data=freqs, dtype=np.float64, compression='gzip')
+
+        # stats_group stores all statistics collected as 2D float32 arrays, resizable
+        # along the time axis
+        stats_group = self.file.create_group('stats')
+        for key in self.stats_keys:
+            stats_group.create_dataset(
+                key, shape=(0, nchan), maxshape=(None, nchan), chunks=self.chunk_shape(nchan, self.flush_every),
+                dtype=np.float32, **self._dataset_options)
+
+        pyramid_group = self.file.create_group('pyramid')
+        pyramid_group.attrs['nlevels'] = self.pyramid_levels
+        for level in range(1, self.pyramid_levels + 1):
+            level_group = pyramid_group.create_group(str(level))
+            level_group.create_dataset(
+                'times', shape=(0,), maxshape=(None,), chunks=(1024,), dtype=np.float64, compression='gzip')
+            # A flush of 'flush_every' blocks completes flush_every / 2^level rows
+            chunks = self.chunk_shape(nchan, self.flush_every >> level)
+            for reduction in REDUCTIONS:
+                reduction_group = level_group.create_group(reduction)
+                for key in self.stats_keys:
+                    reduction_group.create_dataset(
+                        key, shape=(0, nchan), maxshape=(None, nchan), chunks=chunks,
+                        dtype=np.float32, **self._dataset_options)
+
+        self.file.create_group('params').attrs.update(self.params)
+        self.file.create_group('progress').attrs.update({
+            'nblock' : 0,
+            'complete' : False,
+            })
+        self.file.flush()
+
+    def _open_existing(self, freqs):
+        self.file = h5py.File(self.fname, 'a', rdcc_nbytes=self._CHUNK_CACHE_BYTES)
+        try:
+            stored = dict(self.file['params'].attrs) if 'params' in self.file else {}
+            mismatched = sorted(
+                key for key in set(stored) | set(self.params)
+                if stored.get(key) != self.params.get(key)
+                )
+            if mismatched:
+                raise ValueError(
+                    'Cannot resume writing {0!r}, parameters differ: {1}'.format(self.fname, ', '.join(mismatched)))
+            if not np.array_equal(self.file['header/freqs'][()], freqs):
+                raise ValueError('Cannot resume writing {0!r}, channel frequencies differ'.format(self.fname))
+            if sorted(self.file['stats'].keys()) != sorted(self.stats_keys):
+                raise ValueError('Cannot resume writing {0!r}, statistics differ'.format(self.fname))
+        except:
+            self.file.close()
+            raise
+
+        # Keep writing whole chunks
+        self.flush_every = self.file['stats'][self.stats_keys[0]].chunks[0]
+
+        # Discard anything written after the last recorded flush
+        nblock = int(self.file['progress'].attrs['nblock'])
+        self.file['header/times'].resize((nblock,))
+        for key in self.stats_keys:
+            self.file['stats'][key].resize(nblock, axis=0)
+
+        # Pyramid levels must only contain the bins completed by these blocks
+        self.pyramid_levels = 0
+        if 'pyramid' in self.file:
+            self.pyramid_levels = int(self.file['pyramid'].attrs['nlevels'])
+        for level in range(1, self.pyramid_levels + 1):
+            level_group = self.file['pyramid'][str(level)]
+            level_group['times'].resize((nblock >> level,))
+            for reduction in REDUCTIONS:
+                for key in self.stats_keys:
+                    level_group[reduction][key].resize(nblock >> level, axis=0)
+        self.file.flush()
+
+    def _replay_pyramid(self):
+        """ Restore the state of the pyramid builder when resuming, by pushing again the
+        blocks of the last incomplete coarsest bin. Bins they complete at lower levels
+        are already in the file. """
+        nblock = len(self.file['header/times'])
+        istart = nblock - nblock % 2**self.pyramid_levels
+        times = self.file['header/times'][istart:nblock]
+        stats = {key: self.file['stats'][key][istart:nblock] for key in self.stats_keys}
+        for irow, time in enumerate(times):
+            self._pyramid.push(time, {key: val[irow] for key, val in stats.items()})
+
+    @property
+    def nblock(self):
+        """ Number of blocks appended so far, including those not yet written. """
+        return len(self.file['header/times']) + len(self._times)
+
+    @property
+    def complete(self):
+        """ True if finalise() has been called. """
+        return bool(self.file['progress'].attrs['complete'])
+
+    def append(self, time, stats_row):
+        """ Append the statistics of one block, given as a dict {stat_name: 1D array}. """
+        self._times.append(time)
+        for key in self.stats_keys:
+            self._rows[key].append(np.array(stats_row[key], dtype=np.float32))
+        self._push_pyramid(time, stats_row)
+        # Flush when reaching a chunk boundary, even if the file did not start on one
+        if self.nblock % self.flush_every == 0:
+            self.flush()
+
+    def extend(self, times, stats):
+        """ Append the statistics of several blocks, given as a dict
+        {stat_name: 2D array with shape (num_blocks, num_channels)}. """
+        self.flush()
+        for irow, time in enumerate(times):
+            self._push_pyramid(time, {key: stats[key][irow] for key in self.stats_keys})
+        self._write(times, stats)
+        self.file.flush()
+
+    def _push_pyramid(self, time, stats_row):
+        for level, tstart, reductions in self._pyramid.push(time, stats_row):
+            self._pyramid_rows[level].append((tstart, reductions))
+
+    def _write_pyramid(self):
+        for level, rows in self._pyramid_rows.items():
+            if not rows:
+                continue
+            level_group = self.file['pyramid'][str(level)]
+            istart = len(level_group['times'])
+            iend = istart + len(rows)
+            level_group['times'].resize((iend,))
+            level_group['times'][istart:] = [tstart for tstart, __ in rows]
+            for reduction in REDUCTIONS:
+                for key in self.stats_keys:
+                    dataset = level_group[reduction][key]
+                    dataset.resize(iend, axis=0)
+                    dataset[istart:] = [reductions[reduction][key] for __, reductions in rows]
+            rows.clear()
+
+    def _write(self, times, stats):
+        times = np.asarray(times)
+        istart = len(self.file['header/times'])
+        iend = istart + len(times)
+        dataset = self.file['header/times']
+        dataset.resize((iend,))
+        dataset[istart:] = times
+        for key in self.stats_keys:
+            dataset = self.file['stats'][key]
+            dataset.resize(iend, axis=0)
+            dataset[istart:] = stats[key]
+        self._write_pyramid()
+        # Progress is recorded last, so that it never accounts for blocks that
+        # have not been fully written
+        self.file['progress'].attrs['nblock'] = iend
+
+    def flush(self):
+        """ Write buffered blocks and flush the file to disk. """
+        if self._times:
+            stats = {key: np.asarray(rows) for key, rows in self._rows.items()}
+            self._write(self._times, stats)
+            self._times = []
+            self._rows = {key: [] for key in self.stats_keys}
+        self.file.flush()
+
+    def write_profile(self, profile):
+        """ Save a profiling summary (see profiling.Profiler.summary()) in the 'profile'
+        group, replacing any previous one. Scalars are stored as attributes, and per-block
+        timings as datasets. """
+        if 'profile' in self.file:
+            del self.file['profile']
+        group = self.file.create_group('profile')
+        group.attrs.update({key: val for key, val in profile.items() if not key in BLOCK_ARRAYS})
+        for key in BLOCK_ARRAYS:
+            if key in profile:
+                group.create_dataset(key, data=profile[key], compression='gzip')
+        self.file.flush()
+
+    def finalise(self):
+        """ Flush and mark the output as complete. """
+        self.flush()
+        self.file['progress'].attrs['complete'] = True
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finalise()
+        self.close()
+
+
+
+
+# Per-process state of analyse_filterbank() worker processes
+_worker_state = {}
+
+def _init_worker(fname, gulp, kwargs, profile):
+    if kwargs.get('nthreads', 1) > 1:
+        # One thread pool per worker, shared by all the blocks it analyses
+        kwargs = dict(kwargs, executor=ThreadPoolExecutor(max_workers=int(kwargs['nthreads'])))
+    _worker_state['filterbank'] = Filterbank(fname)
+    _worker_state['gulp'] = gulp
+    _worker_state['kwargs'] = kwargs
+    _worker_state['profile'] = profile
+
+def _analyse_block_at(isamp):
+    """ Analyse the block starting at sample index 'isamp', in a worker process. Data
+    are read from the worker's own memory map of the file, only the (small) block
+    statistics are sent back to the parent process, along with the block's profiling
+    totals if profiling is enabled. """
+    fil = _worker_state['filterbank']
+    profiler = Profiler() if _worker_state['profile'] else NULL_PROFILER
+    with profiler.stage('read'):
+        data = fil.get_samples(isamp, isamp + _worker_state['gulp'])
+        if profiler is not NULL_PROFILER:
+            _fault_in(data)
+    __, __, block_stats = analyse_block(data, profiler=profiler, **_worker_state['kwargs'])
+    if profiler is NULL_PROFILER:
+        return isamp, block_stats, None
+    profiler.bytes_read += data.nbytes
+    return isamp, block_stats, profiler.totals()
+
+def _analyse_blocks_serial(iterator, get_row, profiler=NULL_PROFILER, **kwargs):
+    """ Analyse all blocks, writing their statistics directly into the dictionary
+    of 1D arrays returned by get_row(block_index). Yields block index, start time
+    and statistics of every block once done. """
+    blocks = iter(iterator)
+    block_bytes = iterator.gulp * iterator.filterbank.bytes_per_sample
+    iblock = 0
+    while True:
+        with profiler.stage('read'):
+            block = next(blocks, None)
+            if block is not None and profiler is not NULL_PROFILER:
+                _fault_in(block.data)
+        if block is None:
+            break
+        # Counted per block, so that the total is right if the caller stops early
+        if isinstance(profiler, Profiler):
+            profiler.bytes_read += block_bytes
+        row = get_row(iblock)
+        analyse_block(block.data, out=row, profiler=profiler, **kwargs)
+        yield iblock, block.times[0], row
+        iblock += 1
+
+def _analyse_blocks_parallel(iterator, get_row, nproc, profiler=NULL_PROFILER, **kwargs):
+    """ Same as _analyse_blocks_serial(), using a pool of 'nproc' processes. """
+    fil = iterator.filterbank
+    initargs = (fil.fname, iterator.gulp, kwargs, isinstance(profiler, Profiler))
+    with multiprocessing.Pool(nproc, initializer=_init_worker, initargs=initargs) as pool:
+        # imap() returns results in submission order, i.e. in time order
+        results = pool.imap(_analyse_block_at, iterator.block_starts)
+        for iblock, (isamp, block_stats, totals) in enumerate(results):
+            if totals is not None:
+                profiler.merge(totals)
+            row = get_row(iblock)
+            for key, val in row.items():
+                val[:] = block_stats[key]
+            yield iblock, isamp * fil.tsamp, row
+
+def analyse_filterbank(fname, start=0, end=None, gulp=2048, wmax=128, wtsp=2.0, thr=6.0, prefetch=0, nproc=1, nthreads=1, precision='float32', fft_workers=1, engine='auto', padlen=None, outfile=None, resume=False, profile=False, on_block=None, progress=False):
+    """ Compute statistics of every block of a filterbank file.
+
+    Parameters:
+    -----------
+        fname: str
+            Path to the SIGPROC filterbank file.
+        start: int
+            Start sample index.
+        end: int or None
+            End sample index. If None, process the file until the end.
+        gulp: int
+            Number of samples per data block.
+        wmax: int
+            Maximum pulse width trial in number of bins
+        wtsp: float
+            Ratio between two consecutive pulse width trials.
+        thr: float
+            Minimum S/N of a pulse for it to be considered
+            statistically significant.
+        prefetch: int
+            Number of blocks read ahead by a background thread, see FilterbankIterator.
+            Ignored if nproc > 1.
+        nproc: int
+            Number of worker processes. Blocks are independent and are then analysed
+            in parallel, every worker reading its blocks directly from the file. The
+            output is identical to that of a serial run.
+        nthreads: int
+            Number of threads analysing chunks of channels in parallel within every
+            block, see analyse_block(). The same pool of threads is used for all blocks
+            (one pool per worker process if nproc > 1).
+        precision: str
+            Floating point type of the convolution products, 'float32' or 'float64'.
+            See analyse_block().
+        fft_workers: int
+            Number of threads used by each FFT, when using the 'fft' engine.
+        engine: str
+            Boxcar convolution engine, see BoxcarConvolver.
+        padlen: int or None
+            Length to which the data are zero-padded before FFT convolution, see
+            BoxcarConvolver. None means automatic. autotune.autotune() measures the
+            fastest gulp, engine and padlen on the current machine.
+        outfile: str or None
+            If specified, statistics are streamed to this HDF5 file as the analysis
+            progresses (see FilterbankStatsWriter) instead of being accumulated in
+            memory. The returned FilterbankStats object is then loaded from it.
+        resume: bool
+            If True and 'outfile' exists, continue the analysis from the last block
+            recorded in it. Analysis parameters and input file size and modification
+            time must match those recorded, otherwise a ValueError is raised.
+        profile: bool
+            If True, record the wall clock and CPU time spent in every stage of the
+            analysis (read, normalise, convolve, mask, aggregate, write), along with the
+            number of bytes read and peak memory usage. The summary is available as the
+            'profile' attribute of the output, and saved in the 'profile' group of
+            'outfile'. See profiling.Profiler.
+        on_block: callable or None
+            Function called after every block as on_block(block_index, time, stats_row),
+            where 'block_index' is the index of the block in the output, 'time' its start
+            time, and 'stats_row' a dict {stat_name: 1D array} of its statistics. The
+            arrays may be re-used for the next block, and must be copied to be kept.
+            If the function returns True, the analysis stops: the statistics of the
+            blocks processed so far are returned, and marked as incomplete, so that the
+            analysis can be resumed later when using 'outfile'.
+        progress: bool
+            If True, report progress, throughput, real-time factor and estimated time
+            remaining on stderr, see progress.ProgressReporter.
+
+    Returns:
+    --------
+        fstats: FilterbankStats
+            Statistics of every block.
+    """
     fil = Filterbank(fname)
-    stats = {}  # dictionary of stats
-    times = []  # start times of each block
+    iterator = FilterbankIterator(fil, gulp=gulp, start=start, end=end, native_dtype=True, prefetch=prefetch)
+
+    writer = None
+    if outfile is not None:
+        params = {
+            'start' : iterator.start,
+            'end' : iterator.end,
+            'wmax' : wmax,
+            'wtsp' : wtsp,
+            'thr' : thr,
+            'precision' : precision,
+            'engine' : engine,
+            'padlen' : padlen,
+            'input_size' : os.path.getsize(fil.fname),
+            'input_mtime' : os.path.getmtime(fil.fname),
+            }
+        metadata = {
+            'input_fname' : fil.fname,
+            'nbits' : fil.nbits,
+            }
+        # Optional header keys
+        for key in ('source_name', 'mjd_start'):
+            try:
+                metadata[key] = getattr(fil, key)
+            except KeyError:
+                pass
+        writer = FilterbankStatsWriter(
+            outfile, fil.tsamp, fil.freqs, gulp, STATS_KEYS, params=params, resume=resume, metadata=metadata)
+        iterator.skip(writer.nblock)
+
+    nblock = len(iterator.block_starts)
+    times = np.empty(nblock)  # start times of each block
+    if writer is None:
+        # Output arrays are allocated once, with one row per block
+        stats = {
+            key: np.empty((nblock, fil.nchans), dtype=np.float32)
+            for key in STATS_KEYS
+            }
+        get_row = lambda iblock: {key: val[iblock] for key, val in stats.items()}
+    else:
+        # A single row is re-used for every block
+        row = {key: np.empty(fil.nchans, dtype=np.float32) for key in STATS_KEYS}
+        get_row = lambda iblock: row
     
-    for block in FilterbankIterator(fil, gulp=gulp, start=start, end=end):
-        print(block)
-        ndata, mask, df = analyse_block(block.data, wmax=wmax, wtsp=wtsp, thr=thr)
-        for key in df.columns:
-            if key in stats:
-                stats[key].append(df[key].values)
-            else:
-                stats[key] = [df[key].values]
-        times.append(block.times[0])
-    return FilterbankStats(fil.tsamp, fil.freqs, gulp, times, stats)
+    # Block hooks
+    hooks = []
+    if on_block is not None:
+        hooks.append(on_block)
+    if progress:
+        hooks.append(ProgressReporter(nblock, iterator.gulp, fil.tsamp))
+    first_block = writer.nblock if writer is not None else 0
+
+    profiler = Profiler() if profile else NULL_PROFILER
+    kwargs = dict(
+        wmax=wmax, wtsp=wtsp, thr=thr, precision=precision, fft_workers=fft_workers, engine=engine,
+        padlen=padlen, nthreads=nthreads, stats_only=True, profiler=profiler)
+    executor = None
+    if nproc > 1:
+        results = _analyse_blocks_parallel(iterator, get_row, nproc, **kwargs)
+    else:
+        if nthreads > 1:
+            # A single thread pool for all blocks, rather than one per block
+            executor = ThreadPoolExecutor(max_workers=int(nthreads))
+        results = _analyse_blocks_serial(iterator, get_row, executor=executor, **kwargs)
+
+    ndone = 0
+    stopped = False
+    try:
+        for iblock, tstart, row in results:
+            times[iblock] = tstart
+            ndone = iblock + 1
+            if writer is not None:
+                with profiler.stage('write'):
+                    writer.append(tstart, row)
+            if profile:
+                profiler.end_block()
+            if hooks:
+                # Call all hooks, even if one asks to stop
+                stopped = any([hook(first_block + iblock, tstart, row) for hook in hooks])
+                if stopped:
+                    break
+        if writer is not None:
+            if profile:
+                writer.write_profile(profiler.summary())
+            if not stopped:
+                writer.finalise()
+    finally:
+        # Stop the worker processes or prefetch thread if exiting early
+        results.close()
+        iterator.close()
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.close()
+
+    if writer is not None:
+        return FilterbankStats.load_hdf5(outfile)
+    summary = profiler.summary() if profile else None
+    stats = {key: val[:ndone] for key, val in stats.items()}
+    return FilterbankStats(fil.tsamp, fil.freqs, gulp, times[:ndone], stats, profile=summary, complete=not stopped)
@@ -0,0 +1,25 @@
+### Standard library imports
+import argparse
+
+### Local module imports
+from rfistats.shards import merge_hdf5
+
+###############################################################################
+
+def parse_args():
+    """ Parse command line arguments with which the script was called. Returns
+    an object containing them all.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('fnames', type=str, nargs='+', help='HDF5 outputs of the shards of an analysis, in time order.')
+    parser.add_argument('-o', '--outname', type=str, required=True, help='Base name of output file. A suffix .h5 is automatically appended.')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    merge_hdf5(args.fnames, args.outname + '.h5')
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,149 @@
+import contextlib
+import resource
+import threading
+import time
+
+import numpy as np
+
+# Stages of the analysis of a block, in processing order
+STAGES = ('read', 'normalise', 'convolve', 'mask', 'aggregate', 'write')
+
+# Per-block arrays of a profile summary, see Profiler.summary()
+BLOCK_ARRAYS = ('block_wall', 'block_cpu', 'block_total_wall', 'block_total_cpu')
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process and of its terminated child processes
+    (e.g. analysis workers), in MiB. """
+    # ru_maxrss is in KiB on Linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, children_rss) / 1024.0
+
+
+def children_cpu_time():
+    """ Total CPU time used by terminated child processes. """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class NullProfiler(object):
+    """ Profiler that does nothing, used when profiling is disabled. """
+    _context = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add(self, name, wall, cpu, calls=1):
+        pass
+
+
+class Profiler(object):
+    """ Accumulates the wall clock and CPU time spent in every stage of the analysis
+    (see STAGES), in total and per block. Stages can be timed concurrently from several
+    threads: times are then summed over threads, and the CPU time of a stage is that of
+    the thread running it.
+
+    Note that data are read through a memory map: the 'read' stage only accounts for
+    copies and conversions, and disk access happens when data are first touched,
+    normally in the 'normalise' stage. """
+    def __init__(self):
+        self.wall = dict.fromkeys(STAGES, 0.0)
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+        self._block_wall = []
+        self._block_cpu = []
+        self._block_total = []
+        self._last_wall = dict(self.wall)
+        self._last_cpu = dict(self.cpu)
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_children_cpu = children_cpu_time()
+        self._last_block_end = (self._start_wall, self._start_cpu)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Context manager timing the code it wraps as part of the given stage. """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add(self, name, wall, cpu, calls=1):
+        """ Add time spent in a stage. """
+        with self._lock:
+            self.wall[name] += wall
+            self.cpu[name] += cpu
+            self.calls[name] += calls
+
+    def merge(self, totals):
+        """ Add the totals of another profiler, as returned by totals(). This is how
+        the work of worker processes is accounted for. """
+        for name in STAGES:
+            self.add(name, totals['wall'][name], totals['cpu'][name], calls=totals['calls'][name])
+        self.bytes_read += totals['bytes_read']
+
+    def totals(self):
+        """ Returns the accumulated totals as a picklable dict. """
+        return {
+            'wall': dict(self.wall),
+            'cpu': dict(self.cpu),
+            'calls': dict(self.calls),
+            'bytes_read': self.bytes_read,
+            }
+
+    def end_block(self):
+        """ Record the wall clock and CPU time spent in every stage since the last call,
+        and the total wall clock and CPU time of this process over the same period. """
+        with self._lock:
+            wall, cpu = time.perf_counter(), time.process_time()
+            self._block_wall.append([self.wall[name] - self._last_wall[name] for name in STAGES])
+            self._block_cpu.append([self.cpu[name] - self._last_cpu[name] for name in STAGES])
+            self._block_total.append([wall - self._last_block_end[0], cpu - self._last_block_end[1]])
+            self._last_wall = dict(self.wall)
+            self._last_cpu = dict(self.cpu)
+            self._last_block_end = (wall, cpu)
+
+    def summary(self):
+        """ Returns a flat dictionary of scalars with the totals of every stage
+        ('<stage>_wall', '<stage>_cpu', '<stage>_calls'), the total wall clock and CPU
+        times of the whole run including worker processes, the number of bytes read,
+        and the peak memory usage. Keys 'block_wall' and 'block_cpu' are 2D arrays with
+        the wall clock and CPU time of every stage (columns, in the order of 'stages') for
+        every block. 'block_total_wall' and 'block_total_cpu' are the wall clock and
+        process CPU time (time.process_time(), which excludes worker processes) elapsed
+        between the ends of consecutive blocks. """
+        summary = {}
+        for name in STAGES:
+            summary[name + '_wall'] = self.wall[name]
+            summary[name + '_cpu'] = self.cpu[name]
+            summary[name + '_calls'] = self.calls[name]
+        summary.update({
+            'nblock': len(self._block_wall),
+            'bytes_read': self.bytes_read,
+            'total_wall': time.perf_counter() - self._start_wall,
+            'total_cpu': time.process_time() - self._start_cpu + children_cpu_time() - self._start_children_cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': list(STAGES),
+            'block_wall': np.asarray(self._block_wall, dtype=np.float64).reshape(-1, len(STAGES)),
+            'block_cpu': np.asarray(self._block_cpu, dtype=np.float64).reshape(-1, len(STAGES)),
+            'block_total_wall': np.asarray(self._block_total, dtype=np.float64).reshape(-1, 2)[:, 0],
+            'block_total_cpu': np.asarray(self._block_total, dtype=np.float64).reshape(-1, 2)[:, 1],
+            })
+        return summary
+
+
+# Shared instance used when profiling is disabled
+NULL_PROFILER = NullProfiler()
+
+
+def profile_to_json(summary):
+    """ Convert a profile summary to a JSON-serialisable dict. """
+    return {
+        key: val.tolist() if isinstance(val, np.ndarray) else (val.item() if isinstance(val, np.generic) else val)
+        for key, val in summary.items()
+        }
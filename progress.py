@@ -0,0 +1,60 @@
+import sys
+import time
+
+
+def format_duration(seconds):
+    """ Format a duration in seconds as HH:MM:SS. """
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+class ProgressReporter(object):
+    """ Block hook for analyse_filterbank() that reports progress, throughput,
+    real-time factor and estimated time remaining. Lines are written at most once every
+    'interval' seconds, and after the last block. """
+    def __init__(self, nblock, gulp, tsamp, interval=1.0, stream=None):
+        """
+        Parameters:
+        -----------
+            nblock: int
+                Number of blocks to be processed.
+            gulp: int
+                Number of samples per block.
+            tsamp: float
+                Sampling time in seconds.
+            interval: float
+                Minimum time between two reports, in seconds.
+            stream: file or None
+                Where reports are written, default is sys.stderr.
+        """
+        self.nblock = int(nblock)
+        self.gulp = int(gulp)
+        self.tsamp = float(tsamp)
+        self.interval = float(interval)
+        self.stream = stream
+        self.count = 0
+        self._start = time.perf_counter()
+        self._last_report = None
+
+    def __call__(self, block_index, time_start, stats_row):
+        self.count += 1
+        now = time.perf_counter()
+        last = self.count >= self.nblock
+        if last or self._last_report is None or now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report(block_index, now - self._start)
+
+    @property
+    def samples_processed(self):
+        return self.count * self.gulp
+
+    def report(self, block_index, elapsed):
+        """ Write one progress line. """
+        rate = self.samples_processed / elapsed if elapsed > 0 else float('inf')
+        remaining = (self.nblock - self.count) * self.gulp / rate if rate else float('inf')
+        line = 'Block {0:d} [{1:d}/{2:d}, {3:5.1f}%]  {4:.0f} samples/s  {5:.2f}x real time  elapsed {6:s}  ETA {7:s}'.format(
+            block_index, self.count, self.nblock, 100.0 * self.count / max(self.nblock, 1), rate,
+            rate * self.tsamp, format_duration(elapsed), format_duration(remaining))
+        print(line, file=self.stream or sys.stderr, flush=True)
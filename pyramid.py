@@ -0,0 +1,69 @@
+import numpy as np
+
+REDUCTIONS = ('mean', 'max')
+
+def reduce_pairs(data, reduction='mean'):
+    """ Halve the time resolution of block statistics, by reducing pairs of consecutive
+    rows of 'data', a 2D array with shape (num_blocks, num_channels). A trailing
+    unpaired row is dropped. Computations are done in float32, exactly like in
+    TimePyramidBuilder, so that both give bit-identical results. """
+    data = np.asarray(data, dtype=np.float32)
+    n = data.shape[0] // 2
+    a = data[0:2*n:2]
+    b = data[1:2*n:2]
+    if reduction == 'mean':
+        return 0.5 * (a + b)
+    elif reduction == 'max':
+        return np.maximum(a, b)
+    raise ValueError('reduction must be one of {0!r}'.format(REDUCTIONS))
+
+
+class TimePyramidBuilder(object):
+    """ Incrementally builds a multi-resolution pyramid of block statistics, where level k
+    contains the mean and max of every statistic over bins of 2^k consecutive blocks.
+    Blocks are pushed one at a time, and only the last unpaired row of every level is
+    kept in memory. """
+    def __init__(self, nlevels, stats_keys):
+        """
+        Parameters:
+        -----------
+            nlevels: int
+                Number of levels built above full resolution, i.e. the coarsest level
+                has bins of 2^nlevels blocks.
+            stats_keys: list
+                Names of the statistics.
+        """
+        self.nlevels = max(0, int(nlevels))
+        self.stats_keys = list(stats_keys)
+        # Unpaired (time, reductions) row at every level below the coarsest
+        self._pending = [None] * self.nlevels
+
+    def push(self, time, stats_row):
+        """ Add the statistics of one block, given as a dict {stat_name: 1D array}.
+
+        Returns:
+        --------
+            completed: list
+                List of (level, time, reductions) tuples, one for every coarse bin
+                completed by this block, in increasing level order. 'time' is the start
+                time of the bin, and 'reductions' a dict {reduction: {stat_name: 1D array}}.
+        """
+        row = {key: np.array(stats_row[key], dtype=np.float32) for key in self.stats_keys}
+        item = (time, {reduction: row for reduction in REDUCTIONS})
+
+        completed = []
+        for level in range(self.nlevels):
+            pending = self._pending[level]
+            if pending is None:
+                self._pending[level] = item
+                break
+            self._pending[level] = None
+
+            (tstart, first), (__, second) = pending, item
+            reductions = {
+                'mean': {key: 0.5 * (first['mean'][key] + second['mean'][key]) for key in self.stats_keys},
+                'max': {key: np.maximum(first['max'][key], second['max'][key]) for key in self.stats_keys},
+                }
+            item = (tstart, reductions)
+            completed.append((level + 1, tstart, reductions))
+        return completed
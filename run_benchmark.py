@@ -0,0 +1,68 @@
+### Standard library imports
+import argparse
+import json
+import tempfile
+
+### Local module imports
+from rfistats.benchmark import run_benchmark, compare_results
+
+###############################################################################
+
+def parse_args():
+    """ Parse command line arguments with which the script was called. Returns
+    an object containing them all.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output', type=str, help='Output JSON file.', default='benchmark.json')
+    parser.add_argument('--workdir', type=str, help='Directory where temporary synthetic data are written. Default: a system temporary directory.', default=None)
+    parser.add_argument('--nchan', type=int, help='Number of channels of the synthetic data.', default=4096)
+    parser.add_argument('--tsamp', type=float, help='Sampling time of the synthetic data in seconds.', default=153.0e-6)
+    parser.add_argument('--duration', type=float, help='Length of the synthetic data in seconds.', default=10.0)
+    parser.add_argument('--nbits', type=int, nargs='+', choices=(8, 32), help='Bit depths to benchmark.', default=[8, 32])
+    parser.add_argument('--gulp', type=int, help='Number of samples read into a single data block.', default=2048)
+    parser.add_argument('--wmax', type=int, help='Maximum pulse width (in samples) being searched for.', default=128)
+    parser.add_argument('--wtsp', type=float, help='Ratio between two consecutive pulse width trials.', default=2.0)
+    parser.add_argument('--thr', type=float, help='S/N threshold used to flag significant pulses when computing channel occupancy.', default=6.0)
+    parser.add_argument('--engine', type=str, choices=('auto', 'fft', 'cumsum'), help='Boxcar convolution engine.', default='auto')
+    parser.add_argument('--precision', type=str, choices=('float32', 'float64'), help='Floating point precision of the convolution products.', default='float32')
+    parser.add_argument('--precision-check', action='store_true', help='Also compare the occupancy masks obtained with float32 and float64 precision.')
+    parser.add_argument('--compare', type=str, help='Previous benchmark JSON file to compare the results with.', default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    kwargs = dict(
+        nchan=args.nchan, tsamp=args.tsamp, duration=args.duration, nbits=args.nbits,
+        gulp=args.gulp, wmax=args.wmax, wtsp=args.wtsp, thr=args.thr,
+        engine=args.engine, precision=args.precision, check_precision=args.precision_check)
+    if args.workdir is None:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_benchmark(workdir, **kwargs)
+    else:
+        results = run_benchmark(args.workdir, **kwargs)
+
+    with open(args.output, 'w') as fobj:
+        json.dump(results, fobj, indent=4)
+
+    for config, stages in results['results'].items():
+        print(config)
+        for stage, result in stages.items():
+            print('    {0:12s} {1:9.3f} s  {2:12.0f} samples/s  {3:8.2f}x real time'.format(
+                stage, result['seconds'], result['samples_per_sec'] or 0.0, result['realtime_factor'] or 0.0))
+
+    for config, check in results.get('precision_check', {}).items():
+        print('{0:s} float32 vs float64: {1:d} of {2:d} mask samples differ ({3:.2e}), occupancy difference max {4:.2e}, mean {5:.2e}'.format(
+            config, check['mask_mismatch'], check['samples'], check['mask_mismatch_fraction'], check['max_occupancy_diff'],
+            check['mean_occupancy_diff']))
+
+    if args.compare:
+        with open(args.compare) as fobj:
+            previous = json.load(fobj)
+        print('Speedup relative to {0:s}'.format(args.compare))
+        for (config, stage), speedup in compare_results(previous, results).items():
+            print('    {0:s} {1:12s} {2:6.2f}x'.format(config, stage, speedup))
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
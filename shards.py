@@ -0,0 +1,67 @@
+from rfistats.filterbank import Filterbank
+from rfistats.filterbank_stats import FilterbankStats, FilterbankStatsWriter, check_mergeable
+
+
+def plan_shards(nsamp, gulp, nshards, start=0, end=None):
+    """ Split the sample range [start, end) of a filterbank into consecutive ranges
+    that can be analysed independently, e.g. on different nodes. Range boundaries are
+    aligned on multiples of 'gulp' samples from 'start', so that the shards contain
+    exactly the same data blocks as a single analysis of the whole range. Bounds are
+    clipped like in FilterbankIterator.
+
+    Parameters:
+    -----------
+        nsamp: int or str
+            Number of samples in the filterbank, or path to the filterbank file.
+        gulp: int
+            Number of samples per data block.
+        nshards: int
+            Number of shards. Some shards are empty if there are fewer blocks than shards.
+        start: int
+            Start sample index.
+        end: int or None
+            End sample index. If None, the end of the file.
+
+    Returns:
+    --------
+        ranges: list
+            List of (start, end) tuples, one per shard.
+    """
+    if isinstance(nsamp, str):
+        nsamp = Filterbank(nsamp).nsamp
+    nshards = max(1, int(nshards))
+    gulp = int(gulp)
+
+    if end is None:
+        end = nsamp
+    end = max(0, min(int(end), nsamp))
+    start = min(max(0, int(start)), end)
+
+    # Shards get the same number of blocks to within one, the last one also
+    # includes any trailing incomplete block, which is ignored anyway
+    nblock = (end - start) // gulp
+    bounds = [start + (nblock * ishard // nshards) * gulp for ishard in range(nshards + 1)]
+    bounds[-1] = end
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def merge_hdf5(fnames, outfile, rows_per_write=4096):
+    """ Merge the HDF5 outputs of an analysis split into shards, given in time order,
+    into a single file identical to the output of an analysis of the whole range. Inputs
+    are checked for consistency like in FilterbankStats.merge(), and are streamed to the
+    output in groups of 'rows_per_write' blocks to keep memory usage low. """
+    inputs = [FilterbankStats.load_hdf5(fname, lazy=True) for fname in fnames]
+    try:
+        params = check_mergeable(inputs)
+        first = inputs[0]
+        writer = FilterbankStatsWriter(
+            outfile, first.tsamp, first.freqs, first.gulp, first.stats_keys, params=params, metadata=first.metadata)
+        with writer:
+            for fstats in inputs:
+                for irow in range(0, fstats.nblock, rows_per_write):
+                    rows = slice(irow, irow + rows_per_write)
+                    stats = {key: getattr(fstats, key)[rows] for key in fstats.stats_keys}
+                    writer.extend(fstats.times[rows], stats)
+    finally:
+        for fstats in inputs:
+            fstats.close()
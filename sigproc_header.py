@@ -147,6 +147,65 @@ def read_sigproc_header(fobj, extra_keys={}):
     return attrs, fobj.tell()
 
 
+def write_str(fobj, s):
+    """ Write string to open binary file object. """
+    data = s.encode()
+    fobj.write(struct.pack('i', len(data)))
+    fobj.write(data)
+
+
+def write_attribute(fobj, key, val, keydb):
+    """ Write SIGPROC {key, value} pair to open binary file object. """
+    atype = keydb.get(key, None)
+    if atype is None:
+        errmsg = 'Type of SIGPROC header attribute \'{0:s}\' is unknown, please specify it'.format(key)
+        raise KeyError(errmsg)
+
+    write_str(fobj, key)
+    if atype == str:
+        write_str(fobj, val)
+    elif atype == int:
+        fobj.write(struct.pack('i', val))
+    elif atype == float:
+        fobj.write(struct.pack('d', val))
+    elif atype == bool:
+        fobj.write(struct.pack('B', int(val))) # B = unsigned char
+    else:
+        errmsg = 'Key \'{0:s}\' has unsupported type \'{1:s}\''.format(key, atype)
+        raise ValueError(errmsg)
+
+
+def write_sigproc_header(fobj, attrs, extra_keys={}):
+    """ Write SIGPROC header to an open file object, at the current position.
+
+    Parameters
+    ----------
+    fobj : file
+        Open file object to write to, in binary mode.
+    attrs : dict
+        Dictionary containing the SIGPROC header attributes
+    extra_keys : dict
+        Optional {key: type} dictionary, specifying how to write any
+        non-standard keys in attrs
+
+    Returns
+    -------
+    bytesize : int
+        Size of the header in bytes
+    """
+    keydb = sigproc_keydb
+    if extra_keys:
+        keydb = sigproc_keydb.copy()
+        keydb.update(extra_keys)
+
+    start = fobj.tell()
+    write_str(fobj, HEADER_START)
+    for key, val in attrs.items():
+        write_attribute(fobj, key, val, keydb)
+    write_str(fobj, HEADER_END)
+    return fobj.tell() - start
+
+
 def parse_float_coord(f):
     """ Parse coordinate in SIGPROC's own decimal floating point,
     to either hours (RA) or degrees (Dec).
@@ -1,16 +1,113 @@
 import numpy as np
 import scipy.stats as sst
 
+def _lerp(a, b, t):
+    """ Linear interpolation between a and b, computed exactly like numpy's
+    percentile() does, so that results are bit-identical. """
+    diff = b - a
+    if t >= 0.5:
+        return b - diff * (1 - t)
+    return a + diff * t
+
+def _histogram_order_statistics(data, ranks, chunksize=256):
+    """ Order statistics of 8-bit integer data along the first axis, obtained exactly
+    from per-column histograms in O(N) instead of sorting. 'data' must be 2D, and
+    'ranks' a sequence of 0-based ranks. Returns a dict {rank: values}. """
+    nrows, ncols = data.shape
+    offset = 128 if data.dtype == np.int8 else 0
+    base = 256 * np.arange(ncols, dtype=np.intp)
+
+    # Accumulate histograms over chunks of rows, to bound the memory used by the
+    # temporary bin index array
+    counts = np.zeros(256 * ncols, dtype=np.intp)
+    for irow in range(0, nrows, chunksize):
+        index = data[irow:irow+chunksize].astype(np.intp)
+        index += base + offset
+        counts += np.bincount(index.ravel(), minlength=256 * ncols)
+    cumcounts = counts.reshape(ncols, 256).cumsum(axis=1)
+
+    # The value of rank r is the first histogram bin whose cumulative count exceeds r
+    return {
+        r: (cumcounts <= r).sum(axis=1) - offset
+        for r in set(ranks)
+        }
+
+def quartiles(data, axis=-1, dtype=None):
+    """ Compute the 25th, 50th and 75th percentiles of data along given axis, with a
+    single partial sort and a single copy of the data. Results are identical to those
+    of np.percentile() (linear interpolation) and np.median(). If axis is None, the
+    data are flattened first.
+
+    8-bit integer data are not sorted at all: their order statistics are read from
+    per-channel histograms instead, which is exact and O(N).
+
+    Parameters:
+    -----------
+        data: ndarray
+            Input data.
+        axis: int or None
+            Axis along which to compute the quartiles.
+        dtype: numpy dtype or None
+            Floating point type of the output, and in which interpolation is done.
+            Results are identical to those obtained on data.astype(dtype). If None,
+            defaults to the type of the data if floating point, float64 otherwise.
+
+    Returns:
+    --------
+        q1, med, q3: ndarray
+            The first quartile, median and third quartile.
+    """
+    data = np.asarray(data)
+    if axis is None:
+        data = data.ravel()
+        axis = 0
+    if dtype is None:
+        dtype = data.dtype if np.issubdtype(data.dtype, np.inexact) else np.float64
+
+    # Order statistics required: both neighbours of the quartiles' fractional
+    # indices, and the maximum that reveals the presence of NaNs
+    n = data.shape[axis]
+    i1, r1 = divmod(n - 1, 4)
+    i3, r3 = divmod(3 * (n - 1), 4)
+    j1 = min(i1 + 1, n - 1)
+    j3 = min(i3 + 1, n - 1)
+    kth = sorted({i1, j1, (n - 1) // 2, n // 2, i3, j3, n - 1})
+
+    if data.dtype in (np.int8, np.uint8):
+        shape = data.shape[:axis] + data.shape[axis+1:]
+        data = np.moveaxis(data, axis, 0).reshape(n, -1)
+        stats = _histogram_order_statistics(data, kth)
+        take = lambda index: stats[index].astype(dtype).reshape(shape)
+    else:
+        part = np.partition(data.astype(dtype, copy=False), kth, axis=axis)
+        take = lambda index: np.take(part, index, axis=axis)
+
+    q1 = _lerp(take(i1), take(j1), r1 / 4.0)
+    q3 = _lerp(take(i3), take(j3), r3 / 4.0)
+    if n % 2:
+        med = take(n // 2)
+    else:
+        med = (take(n // 2 - 1) + take(n // 2)) / 2
+
+    nan = np.isnan(take(n - 1))
+    if np.any(nan):
+        q1, med, q3 = [np.where(nan, np.nan, q).astype(q.dtype) for q in (q1, med, q3)]
+    return q1, med, q3
+
+def median_and_robust_std(data, axis=-1, dtype=None):
+    """ Median and robust standard deviation of data along given axis, computed
+    in a single pass. See robust_std() and quartiles(). """
+    q1, med, q3 = quartiles(data, axis=axis, dtype=dtype)
+    return med, (q3 - q1) / 1.3489795
+
 def robust_std(data, axis=-1):
     """ Estimate the standard deviation of data from its inter-quartile range. """
-    iqr = np.percentile(data, 75, axis=axis) - np.percentile(data, 25, axis=axis)
-    return iqr / 1.3489795
+    return median_and_robust_std(data, axis=axis)[1]
 
 def outlier_mask(data):
     n = data.size
     nsigma = max(sst.norm.isf(1.0 / n), 3.0)
-    s = robust_std(data)
-    m = np.median(data)
+    m, s = median_and_robust_std(data, axis=None)
     vmin = m - nsigma*s
     vmax = m + nsigma*s
     mask = (data < vmin) | (data > vmax)
@@ -21,4 +118,4 @@ def outlier_mask(data):
         'vmin' : vmin,
         'vmax': vmax
         }
-    return mask, stats 
+    return mask, stats
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The repository directory is the 'rfistats' package itself: make its parent importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from rfistats.benchmark import generate_filterbank
+
+
+@pytest.fixture(scope='session', params=[8, 32])
+def filterbank(request, tmp_path_factory):
+    """ Small synthetic filterbank with pulses and RFI, 8-bit and 32-bit. """
+    fname = str(tmp_path_factory.mktemp('data') / 'synthetic_{0:d}bit.fil'.format(request.param))
+    generate_filterbank(fname, 8192, nchan=64, tsamp=1.0e-3, nbits=request.param, seed=42)
+    return fname
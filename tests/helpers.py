@@ -0,0 +1,22 @@
+""" Analysis parameters and helper functions shared by the tests. """
+import numpy as np
+
+from rfistats.block_stats import STATS_KEYS
+from rfistats.filterbank_stats import FilterbankIterator
+
+GULP = 1024
+WMAX = 32
+KWARGS = dict(gulp=GULP, wmax=WMAX, wtsp=2.0, thr=6.0)
+
+
+def first_block(fname, native_dtype=True):
+    """ Copy of the first data block of a filterbank file. """
+    return next(iter(FilterbankIterator(fname, gulp=GULP, native_dtype=native_dtype))).data.copy()
+
+
+def assert_same_stats(a, b):
+    """ Check that two FilterbankStats objects hold identical statistics. """
+    assert np.array_equal(a.times, b.times)
+    assert np.array_equal(a.freqs, b.freqs)
+    for key in STATS_KEYS:
+        assert np.array_equal(np.asarray(getattr(a, key)), np.asarray(getattr(b, key))), key
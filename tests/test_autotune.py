@@ -0,0 +1,26 @@
+import pytest
+
+from rfistats.autotune import autotune, estimate_memory
+from rfistats.convolution import padlength
+
+
+def test_autotune_rejects_empty_range(tmp_path):
+    with pytest.raises(ValueError, match='nsamp_max'):
+        autotune(16, nsamp_max=0, cache_file=str(tmp_path / 'autotune.json'))
+
+
+def test_autotune_caches_choice(tmp_path):
+    cache_file = str(tmp_path / 'autotune.json')
+    kwargs = dict(wmax=16, gulps=(64, 128), repeat=1, cache_file=cache_file)
+    result = autotune(8, **kwargs)
+    assert result['gulp'] in (64, 128)
+    assert result['engine'] in ('cumsum', 'fft')
+    assert len(result['trials']) == 8
+    assert autotune(8, **kwargs) == result
+
+
+def test_estimate_memory_default_padlen():
+    kwargs = dict(nchan=512, gulp=2048, wmax=128, wtsp=2.0)
+    default = estimate_memory(engine='fft', **kwargs)
+    assert default == estimate_memory(engine='fft', padlen=padlength(2048 + 128 + 1), **kwargs)
+    assert default > estimate_memory(engine='cumsum', **kwargs)
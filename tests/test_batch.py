@@ -0,0 +1,65 @@
+import os
+
+import h5py
+import pytest
+
+from rfistats.batch import KEY_PARAMS, analyse_many, output_names, output_status
+from rfistats.benchmark import generate_filterbank
+from rfistats.filterbank_stats import analyse_filterbank
+
+
+def test_output_names():
+    assert output_names(['/data/a.fil', '/data/b.fil']) == ['a.h5', 'b.h5']
+    assert output_names(['/data/beam00/obs.fil', '/data/beam01/obs.fil']) == ['beam00__obs.h5', 'beam01__obs.h5']
+    with pytest.raises(ValueError):
+        output_names(['/data/obs.fil', '/data/obs.fil'])
+
+
+def test_batch_resume_reports_samples_processed(tmp_path):
+    fnames = []
+    for beam in ('beam00', 'beam01'):
+        os.makedirs(str(tmp_path / beam))
+        fnames.append(str(tmp_path / beam / 'obs.fil'))
+        generate_filterbank(fnames[-1], 4096, nchan=16, tsamp=1.0e-3, seed=len(fnames))
+    outdir = str(tmp_path / 'out')
+    params = dict(gulp=512, wmax=16, wtsp=2.0, thr=6.0)
+
+    # Leave a partial output of 3 blocks out of 8 for the first input
+    os.makedirs(outdir)
+    stop = lambda iblock, time, row: iblock >= 2
+    analyse_filterbank(fnames[0], outfile=os.path.join(outdir, 'beam00__obs.h5'), on_block=stop, **params)
+
+    summaries = analyse_many(fnames, outdir, **params)
+    assert [summary['status'] for summary in summaries] == ['resumed', 'done']
+    assert summaries[0]['bytes'] == 5 * 512 * 16
+    assert summaries[1]['bytes'] == 8 * 512 * 16
+    for name in ('beam00__obs.h5', 'beam01__obs.h5'):
+        with h5py.File(os.path.join(outdir, name), 'r') as fobj:
+            assert fobj['progress'].attrs['complete']
+
+
+def test_batch_reprocesses_other_precision(tmp_path):
+    fname = str(tmp_path / 'obs.fil')
+    generate_filterbank(fname, 2048, nchan=16, tsamp=1.0e-3)
+    outdir = str(tmp_path / 'out')
+    params = dict(gulp=512, wmax=16, wtsp=2.0, thr=6.0)
+    assert analyse_many([fname], outdir, **params)[0]['status'] == 'done'
+    assert analyse_many([fname], outdir, **params)[0]['status'] == 'skipped'
+    assert analyse_many([fname], outdir, precision='float64', **params)[0]['status'] == 'done'
+    with h5py.File(os.path.join(outdir, 'obs.h5'), 'r') as fobj:
+        assert fobj['params'].attrs['precision'] == 'float64'
+
+
+def test_output_status_compares_key_params(tmp_path):
+    fname = str(tmp_path / 'obs.fil')
+    generate_filterbank(fname, 2048, nchan=16, tsamp=1.0e-3)
+    outfile = str(tmp_path / 'obs.h5')
+    params = dict(gulp=512, wmax=16, wtsp=2.0, thr=6.0, precision='float32', engine='auto')
+    assert set(params) == set(KEY_PARAMS)
+    assert output_status(fname, outfile, **params) == 'stale'
+    analyse_filterbank(fname, outfile=outfile, **params)
+    # Parameters outside of the key do not matter
+    assert output_status(fname, outfile, nthreads=2, **params) == 'done'
+    changed = dict(gulp=1024, wmax=32, wtsp=1.5, thr=5.0, precision='float64', engine='fft')
+    for name in KEY_PARAMS:
+        assert output_status(fname, outfile, **dict(params, **{name: changed[name]})) == 'stale'
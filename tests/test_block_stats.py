@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rfistats.block_stats import STATS_KEYS, analyse_block, analyse_segment, occupancy_mask_1d_reference
+from rfistats.convolution import BoxcarConvolver
+
+from helpers import GULP, WMAX, first_block
+
+
+def test_mask_matches_reference(filterbank):
+    data = first_block(filterbank)
+    ndata, mask, stats = analyse_block(data, wmax=WMAX, engine='fft')
+    convolver = BoxcarConvolver(GULP, wmax=WMAX, wtsp=2.0, engine='fft')
+    for ichan in range(data.shape[1]):
+        __, ref = occupancy_mask_1d_reference(ndata[ichan], convolver)
+        assert np.array_equal(mask[ichan], ref)
+
+
+def test_block_matches_segments(filterbank):
+    data = first_block(filterbank)
+    ndata, mask, stats = analyse_block(data, wmax=WMAX)
+    convolver = BoxcarConvolver(GULP, wmax=WMAX, wtsp=2.0)
+    for ichan in range(data.shape[1]):
+        segment = analyse_segment(data[:, ichan], convolver)
+        assert np.array_equal(ndata[ichan], segment['ndata'])
+        assert np.array_equal(mask[ichan], segment['mask'])
+        for key in STATS_KEYS:
+            assert stats[key][ichan] == segment[key]
+
+
+def test_native_8bit_matches_float32(filterbank):
+    native = first_block(filterbank, native_dtype=True)
+    converted = first_block(filterbank, native_dtype=False)
+    a = analyse_block(native, wmax=WMAX)
+    b = analyse_block(converted, wmax=WMAX)
+    assert np.array_equal(a[0], b[0])
+    assert np.array_equal(a[1], b[1])
+    for key in STATS_KEYS:
+        assert np.array_equal(a[2][key], b[2][key])
+
+
+def test_thread_pool_matches_serial(filterbank):
+    data = first_block(filterbank)
+    ndata, mask, stats = analyse_block(data, wmax=WMAX, chunksize=16)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pndata, pmask, pstats = analyse_block(data, wmax=WMAX, chunksize=16, executor=pool)
+        assert np.array_equal(ndata, pndata)
+        assert np.array_equal(mask, pmask)
+        for key in STATS_KEYS:
+            assert np.array_equal(stats[key], pstats[key])
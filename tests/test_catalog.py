@@ -0,0 +1,120 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from rfistats.block_stats import STATS_KEYS
+from rfistats.catalog import StatsCatalog
+from rfistats.filterbank_stats import FilterbankStats
+
+NCHAN = 16
+
+
+def make_stats(fname, seed=0, fch1=1400.0, source_name='A', mjd_start=60000.0, nblock=10):
+    rng = np.random.default_rng(seed)
+    freqs = fch1 - np.arange(NCHAN)
+    stats = {key: rng.random((nblock, NCHAN)).astype(np.float32) for key in STATS_KEYS}
+    metadata = {'source_name': source_name, 'mjd_start': mjd_start}
+    fstats = FilterbankStats(1.0e-3, freqs, 128, 0.128 * np.arange(nblock), stats, metadata=metadata)
+    fstats.save_hdf5(fname)
+    return fstats
+
+
+def test_ingest_skips_unchanged_and_replaces_changed(tmp_path):
+    fname = str(tmp_path / 'obs.h5')
+    make_stats(fname, seed=0)
+    with StatsCatalog(str(tmp_path / 'catalog.h5')) as catalog:
+        assert catalog.ingest(fname)
+        assert not catalog.ingest(fname)
+        assert catalog.ingest(fname, force=True)
+        assert len(catalog) == 1
+
+        fstats = make_stats(fname, seed=1, nblock=12)
+        mtime = os.path.getmtime(fname) + 10.0
+        os.utime(fname, (mtime, mtime))
+        assert not fname in catalog
+        assert catalog.ingest(fname)
+        assert len(catalog) == 1
+        name, = catalog.select()
+        assert catalog.metadata(name)['nblock'] == 12
+        __, values = catalog.channel_summary(name, 'occupancy', 'max')
+        assert np.array_equal(values, fstats.occupancy.max(axis=0))
+
+
+def test_ingest_many_reports_failures(tmp_path):
+    good = str(tmp_path / 'good.h5')
+    make_stats(good)
+    other = str(tmp_path / 'other.h5')
+    with h5py.File(other, 'w') as fobj:
+        fobj.create_dataset('data', data=np.zeros(4))
+    catalog_fname = str(tmp_path / 'catalog.h5')
+    fnames = [catalog_fname, good, other, str(tmp_path / 'missing.h5')]
+
+    with StatsCatalog(catalog_fname) as catalog:
+        results = catalog.ingest_many(fnames)
+        assert [result['status'] for result in results] == ['skipped', 'ingested', 'failed', 'failed']
+        assert results[2]['error'].startswith('KeyError')
+        assert results[3]['error'].startswith(('FileNotFoundError', 'OSError'))
+        assert len(catalog) == 1
+        with pytest.raises(ValueError):
+            catalog.ingest(catalog_fname)
+
+
+def test_failed_ingest_keeps_previous_entry(tmp_path):
+    fname = str(tmp_path / 'obs.h5')
+    make_stats(fname)
+    with StatsCatalog(str(tmp_path / 'catalog.h5')) as catalog:
+        catalog.ingest(fname)
+        with h5py.File(fname, 'w') as fobj:
+            fobj.create_dataset('data', data=np.zeros(4))
+        with pytest.raises(KeyError):
+            catalog.ingest(fname)
+        assert len(catalog) == 1
+        assert len(catalog.select()) == 1
+
+
+def test_repack_reclaims_replaced_entries(tmp_path):
+    fname = str(tmp_path / 'obs.h5')
+    catalog_fname = str(tmp_path / 'catalog.h5')
+    make_stats(fname, nblock=100)
+    with StatsCatalog(catalog_fname) as catalog:
+        for __ in range(20):
+            catalog.ingest(fname, force=True)
+        name, = catalog.select()
+        before = catalog.channel_summary(name)
+        size = os.path.getsize(catalog_fname)
+        catalog.repack()
+        assert os.path.getsize(catalog_fname) < size
+        assert len(catalog) == 1
+        after = catalog.channel_summary(name)
+        assert all(np.array_equal(a, b) for a, b in zip(before, after))
+        # Entry names keep increasing after a repack
+        make_stats(str(tmp_path / 'new.h5'))
+        catalog.ingest(str(tmp_path / 'new.h5'))
+        assert len(set(catalog.select())) == 2
+
+
+def test_channel_aggregate_selection(tmp_path):
+    fnames = [str(tmp_path / 'obs{0:d}.h5'.format(i)) for i in range(4)]
+    fstats = [
+        make_stats(fnames[0], seed=0, source_name='A', mjd_start=60000.0),
+        make_stats(fnames[1], seed=1, source_name='A', mjd_start=60010.0),
+        make_stats(fnames[2], seed=2, source_name='B', mjd_start=60020.0),
+        make_stats(fnames[3], seed=3, source_name='A', mjd_start=60030.0, fch1=800.0),
+        ]
+    with StatsCatalog(str(tmp_path / 'catalog.h5')) as catalog:
+        catalog.ingest_many(fnames)
+        freqs, values, names = catalog.channel_aggregate('occupancy', 'mean', 'max', source_name='A', fmin=1000.0)
+        assert len(names) == 2
+        assert np.array_equal(freqs, fstats[0].freqs)
+        means = [fs.occupancy.mean(axis=0, dtype=np.float64).astype(np.float32) for fs in fstats[:2]]
+        assert np.array_equal(values, np.max(means, axis=0))
+
+        __, __, names = catalog.channel_aggregate(mjd_min=60005.0, mjd_max=60025.0)
+        assert [catalog.metadata(name)['source_name'] for name in names] == ['A', 'B']
+
+        with pytest.raises(ValueError, match='channel frequencies'):
+            catalog.channel_aggregate(source_name='A')
+        with pytest.raises(ValueError, match='No catalog entry'):
+            catalog.channel_aggregate(source_name='C')
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from rfistats.block_stats import normalise_block
+from rfistats.convolution import BoxcarConvolver, clear_convolver_cache, convolver_cache_info
+from rfistats.filterbank_stats import analyse_filterbank
+
+from helpers import GULP, WMAX, KWARGS, first_block
+
+
+@pytest.mark.parametrize('engine', ['fft', 'cumsum'])
+def test_batched_convolution_matches_per_channel(filterbank, engine):
+    ndata, __, __ = normalise_block(first_block(filterbank))
+    convolver = BoxcarConvolver(GULP, wmax=WMAX, wtsp=2.0, engine=engine)
+    batched = convolver.process_block(ndata)
+    for ichan in range(ndata.shape[1]):
+        assert np.array_equal(batched[ichan], convolver.process(ndata[:, ichan]))
+
+
+def test_convolver_built_once_per_run(filterbank):
+    clear_convolver_cache()
+    stats = analyse_filterbank(filterbank, **KWARGS)
+    info = convolver_cache_info()
+    assert info.misses == 1
+    assert info.hits == stats.nblock - 1
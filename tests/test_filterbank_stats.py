@@ -0,0 +1,43 @@
+import pytest
+
+from rfistats.filterbank_stats import analyse_filterbank
+
+from helpers import KWARGS, assert_same_stats
+
+
+def test_processes_match_serial(filterbank):
+    serial = analyse_filterbank(filterbank, **KWARGS)
+    parallel = analyse_filterbank(filterbank, nproc=2, **KWARGS)
+    assert_same_stats(serial, parallel)
+
+
+def test_threads_match_serial(filterbank):
+    serial = analyse_filterbank(filterbank, **KWARGS)
+    parallel = analyse_filterbank(filterbank, nthreads=2, **KWARGS)
+    assert_same_stats(serial, parallel)
+
+
+def test_resume_matches_uninterrupted(filterbank, tmp_path):
+    full = analyse_filterbank(filterbank, outfile=str(tmp_path / 'full.h5'), **KWARGS)
+
+    outfile = str(tmp_path / 'resumed.h5')
+    stop_after_three = lambda iblock, time, row: iblock >= 2
+    partial = analyse_filterbank(filterbank, outfile=outfile, on_block=stop_after_three, **KWARGS)
+    assert not partial.complete
+    assert partial.nblock == 3
+    resumed = analyse_filterbank(filterbank, outfile=outfile, resume=True, **KWARGS)
+    assert resumed.complete
+    assert_same_stats(full, resumed)
+    for level in (1, 2):
+        for reduction in ('mean', 'max'):
+            assert_same_stats(full.at_resolution(level, reduction), resumed.at_resolution(level, reduction))
+
+
+def test_resume_rejects_other_engine(filterbank, tmp_path):
+    outfile = str(tmp_path / 'stats.h5')
+    stop = lambda iblock, time, row: True
+    analyse_filterbank(filterbank, outfile=outfile, engine='cumsum', on_block=stop, **KWARGS)
+    with pytest.raises(ValueError, match='engine'):
+        analyse_filterbank(filterbank, outfile=outfile, resume=True, engine='fft', **KWARGS)
+    with pytest.raises(ValueError, match='padlen'):
+        analyse_filterbank(filterbank, outfile=outfile, resume=True, engine='cumsum', padlen=2048, **KWARGS)
@@ -0,0 +1,52 @@
+import gc
+import threading
+import time
+
+import numpy as np
+
+from rfistats.filterbank_stats import FilterbankIterator, analyse_filterbank
+
+from helpers import KWARGS, assert_same_stats
+
+
+def prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.daemon and thread.is_alive()]
+
+
+def wait_for_threads(expected, timeout=5.0):
+    deadline = time.time() + timeout
+    while len(prefetch_threads()) > expected and time.time() < deadline:
+        time.sleep(0.05)
+    return len(prefetch_threads())
+
+
+def test_prefetch_matches_direct_reads(filterbank):
+    direct = [block.data.copy() for block in FilterbankIterator(filterbank, gulp=1000, native_dtype=True)]
+    with FilterbankIterator(filterbank, gulp=1000, native_dtype=True, prefetch=2) as iterator:
+        prefetched = [block.data.copy() for block in iterator]
+    assert len(direct) == len(prefetched)
+    for a, b in zip(direct, prefetched):
+        assert np.array_equal(a, b)
+
+
+def test_prefetch_analysis_matches_serial(filterbank):
+    serial = analyse_filterbank(filterbank, **KWARGS)
+    prefetched = analyse_filterbank(filterbank, prefetch=2, **KWARGS)
+    assert_same_stats(serial, prefetched)
+
+
+def test_prefetch_thread_stops_on_exit(filterbank):
+    before = len(prefetch_threads())
+    with FilterbankIterator(filterbank, gulp=256, prefetch=1) as iterator:
+        next(iterator)
+        assert len(prefetch_threads()) == before + 1
+    assert len(prefetch_threads()) == before
+
+
+def test_prefetch_thread_stops_when_iterator_dropped(filterbank):
+    before = len(prefetch_threads())
+    for block in FilterbankIterator(filterbank, gulp=256, prefetch=1):
+        break
+    del block
+    gc.collect()
+    assert wait_for_threads(before) == before
@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+
+from rfistats.filterbank_stats import analyse_filterbank
+from rfistats.profiling import STAGES, profile_to_json
+
+
+def test_profile_per_block(filterbank, tmp_path):
+    outfile = str(tmp_path / 'stats.h5')
+    fstats = analyse_filterbank(filterbank, gulp=1024, wmax=32, outfile=outfile, profile=True)
+    profile = fstats.profile
+    nblock = fstats.nblock
+    assert profile['nblock'] == nblock
+    assert profile['block_wall'].shape == (nblock, len(STAGES))
+    assert profile['block_cpu'].shape == (nblock, len(STAGES))
+    assert profile['block_total_wall'].shape == (nblock,)
+    assert profile['block_total_cpu'].shape == (nblock,)
+    assert np.all(profile['block_total_cpu'] > 0)
+    # Per-block stage CPU times add up to the totals, apart from work done after the
+    # last block (e.g. reaching the end of the file)
+    for istage, stage in enumerate(STAGES):
+        assert profile['block_cpu'][:, istage].sum() <= profile[stage + '_cpu'] + 1.0e-9
+
+    summary = json.loads(json.dumps(profile_to_json(profile)))
+    assert len(summary['block_total_cpu']) == nblock
+
+
+def test_bytes_read_on_early_stop(filterbank, tmp_path):
+    stop_after_three = lambda iblock, time, row: iblock >= 2
+    full = analyse_filterbank(filterbank, gulp=1024, wmax=32, profile=True)
+    block_bytes = full.profile['bytes_read'] // full.nblock
+    assert block_bytes > 0
+    partial = analyse_filterbank(filterbank, gulp=1024, wmax=32, profile=True, on_block=stop_after_three)
+    assert partial.profile['bytes_read'] == 3 * block_bytes
+    outfile = str(tmp_path / 'stats.h5')
+    partial = analyse_filterbank(filterbank, gulp=1024, wmax=32, profile=True, on_block=stop_after_three, outfile=outfile)
+    assert partial.profile['bytes_read'] == 3 * block_bytes
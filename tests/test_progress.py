@@ -0,0 +1,37 @@
+import io
+
+from rfistats.filterbank_stats import analyse_filterbank
+from rfistats.progress import ProgressReporter, format_duration
+
+
+def test_format_duration():
+    assert format_duration(0) == '00:00:00'
+    assert format_duration(59.6) == '00:01:00'
+    assert format_duration(3 * 3600 + 25 * 60 + 7) == '03:25:07'
+
+
+def test_reports_first_and_last_block():
+    stream = io.StringIO()
+    reporter = ProgressReporter(5, 1000, 1.0e-3, interval=3600.0, stream=stream)
+    for iblock in range(5):
+        assert not reporter(10 + iblock, 0.0, None)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('Block 10 [1/5,  20.0%]')
+    assert lines[1].startswith('Block 14 [5/5, 100.0%]')
+    assert lines[1].endswith('ETA 00:00:00')
+    assert reporter.samples_processed == 5000
+
+
+def test_reports_every_block_with_zero_interval():
+    stream = io.StringIO()
+    reporter = ProgressReporter(3, 100, 1.0e-3, interval=0.0, stream=stream)
+    for iblock in range(3):
+        reporter(iblock, 0.0, None)
+    assert len(stream.getvalue().splitlines()) == 3
+
+
+def test_progress_option_writes_to_stderr(filterbank, capsys):
+    fstats = analyse_filterbank(filterbank, gulp=1024, wmax=32, progress=True)
+    lines = capsys.readouterr().err.splitlines()
+    assert lines[-1].startswith('Block {0:d} [{1:d}/{1:d}, 100.0%]'.format(fstats.nblock - 1, fstats.nblock))
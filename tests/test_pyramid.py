@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from rfistats.block_stats import STATS_KEYS
+from rfistats.filterbank_stats import FilterbankStats, LazyDataset, analyse_filterbank
+
+from helpers import KWARGS
+
+
+@pytest.mark.parametrize('reduction', ['mean', 'max'])
+def test_stored_pyramid_matches_computed(filterbank, tmp_path, reduction):
+    outfile = str(tmp_path / 'stats.h5')
+    analyse_filterbank(filterbank, outfile=outfile, **KWARGS)
+    eager = FilterbankStats.load_hdf5(outfile)
+    with FilterbankStats.load_hdf5(outfile, lazy=True) as lazy:
+        for level in (1, 2, 3):
+            computed = eager.at_resolution(level, reduction)
+            stored = lazy.at_resolution(level, reduction)
+            assert stored.nblock == eager.nblock >> level
+            assert stored.gulp == computed.gulp
+            assert np.array_equal(stored.times, computed.times)
+            for key in STATS_KEYS:
+                # Read from the file's pyramid, not computed from full resolution
+                assert isinstance(getattr(stored, key), LazyDataset)
+                assert np.array_equal(np.asarray(getattr(stored, key)), getattr(computed, key))
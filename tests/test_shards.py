@@ -0,0 +1,18 @@
+from rfistats.filterbank_stats import FilterbankStats, analyse_filterbank
+from rfistats.shards import plan_shards, merge_hdf5
+
+from helpers import GULP, KWARGS, assert_same_stats
+
+
+def test_merged_shards_match_single_run(filterbank, tmp_path):
+    full = analyse_filterbank(filterbank, outfile=str(tmp_path / 'full.h5'), **KWARGS)
+
+    fnames = []
+    for ishard, (start, end) in enumerate(plan_shards(filterbank, GULP, 3)):
+        fnames.append(str(tmp_path / 'shard{0:d}.h5'.format(ishard)))
+        analyse_filterbank(filterbank, start=start, end=end, outfile=fnames[-1], **KWARGS)
+    merge_hdf5(fnames, str(tmp_path / 'merged.h5'))
+    merged = FilterbankStats.load_hdf5(str(tmp_path / 'merged.h5'))
+    assert merged.params == full.params
+    assert_same_stats(full, merged)
+    assert_same_stats(full.at_resolution(2), merged.at_resolution(2))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from rfistats.stats_utils import median_and_robust_std, quartiles
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int8, np.uint8])
+@pytest.mark.parametrize('nsamp', [1, 2, 7, 1000, 1001])
+def test_quartiles_match_numpy(dtype, nsamp):
+    rng = np.random.default_rng(nsamp)
+    data = (rng.standard_normal((nsamp, 5)) * 20).clip(-128, 127)
+    if dtype == np.uint8:
+        data += 128
+    data = data.astype(dtype)
+
+    q1, med, q3 = quartiles(data, axis=0)
+    ref = data.astype(q1.dtype)
+    assert np.array_equal(q1, np.percentile(ref, 25, axis=0))
+    assert np.array_equal(q3, np.percentile(ref, 75, axis=0))
+    assert np.array_equal(med, np.median(ref, axis=0))
+
+    m, s = median_and_robust_std(data, axis=0)
+    assert np.array_equal(m, med)
+    assert np.array_equal(s, (q3 - q1) / 1.3489795)
+
+
+def test_quartiles_propagate_nan():
+    data = np.arange(20, dtype=np.float32).reshape(10, 2)
+    data[3, 1] = np.nan
+    q1, med, q3 = quartiles(data, axis=0)
+    assert np.isfinite([q1[0], med[0], q3[0]]).all()
+    assert np.isnan([q1[1], med[1], q3[1]]).all()
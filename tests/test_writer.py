@@ -0,0 +1,69 @@
+import h5py
+import numpy as np
+import pytest
+
+from rfistats.block_stats import STATS_KEYS
+from rfistats.filterbank_stats import FilterbankStats, FilterbankStatsWriter, LazyDataset
+
+NCHAN = 40
+
+
+def rows(nblock, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{key: rng.random(NCHAN).astype(np.float32) for key in STATS_KEYS} for __ in range(nblock)]
+
+
+def write(fname, blocks, istart=0, resume=False, finalise=True, **kwargs):
+    writer = FilterbankStatsWriter(fname, 1.0e-3, np.arange(NCHAN), 128, STATS_KEYS, resume=resume, pyramid_levels=3, **kwargs)
+    for iblock, row in enumerate(blocks, start=istart):
+        writer.append(0.128 * iblock, row)
+    if finalise:
+        writer.finalise()
+    writer.close()
+
+
+@pytest.mark.parametrize('flush_every', [1, 3, 4, 256])
+def test_chunks_match_flush_cadence(tmp_path, flush_every):
+    fname = str(tmp_path / 'stats.h5')
+    write(fname, rows(5), flush_every=flush_every)
+    expected = 2**int(np.ceil(np.log2(flush_every)))
+    with h5py.File(fname, 'r') as fobj:
+        assert fobj['stats/median'].chunks[0] == expected
+        for level in (1, 2, 3):
+            assert fobj['pyramid/{0:d}/mean/median'.format(level)].chunks[0] == max(1, expected >> level)
+
+
+def test_resume_from_unaligned_length(tmp_path):
+    blocks = rows(21)
+    write(str(tmp_path / 'full.h5'), blocks, flush_every=4)
+    write(str(tmp_path / 'resumed.h5'), blocks[:7], flush_every=4, finalise=False)
+    # The flush cadence of the existing file is used
+    write(str(tmp_path / 'resumed.h5'), blocks[7:], istart=7, resume=True, flush_every=64)
+
+    full = FilterbankStats.load_hdf5(str(tmp_path / 'full.h5'))
+    resumed = FilterbankStats.load_hdf5(str(tmp_path / 'resumed.h5'))
+    assert resumed.complete
+    assert np.array_equal(full.times, resumed.times)
+    for level in (0, 1, 2, 3):
+        for reduction in ('mean', 'max'):
+            a = full.at_resolution(level, reduction)
+            b = resumed.at_resolution(level, reduction)
+            for key in STATS_KEYS:
+                assert np.array_equal(getattr(a, key), getattr(b, key))
+
+
+def test_lazy_load_matches_eager(tmp_path):
+    fname = str(tmp_path / 'stats.h5')
+    write(fname, rows(21), flush_every=4)
+    eager = FilterbankStats.load_hdf5(fname)
+    with FilterbankStats.load_hdf5(fname, lazy=True) as lazy:
+        for key in STATS_KEYS:
+            data = getattr(lazy, key)
+            assert isinstance(data, LazyDataset)
+            assert data.shape == (21, NCHAN)
+            assert np.array_equal(data[3:17, 5:30], getattr(eager, key)[3:17, 5:30])
+            assert np.array_equal(data[:, 7], getattr(eager, key)[:, 7])
+            assert np.array_equal(np.asarray(data), getattr(eager, key))
+            # Chunked float64 accumulation vs numpy's float32 mean
+            assert np.allclose(lazy.time_average(key), eager.time_average(key), rtol=1e-6, atol=0)
+            assert lazy.time_average(key).dtype == eager.time_average(key).dtype